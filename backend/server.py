@@ -1,24 +1,59 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, UploadFile, File, Form, Header, Query
+from fastapi.responses import Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from gridfs.errors import FileExists, NoFile
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Union, get_args, get_origin
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import base64
 import shutil
-from openpyxl import load_workbook
+import copy
+import csv
+import fcntl
+import functools
+import hashlib
+import html
+import io
+import operator
+import tempfile
+import threading
+import zipfile
+import time
+import asyncio
+import random
+import secrets
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from openpyxl import Workbook, load_workbook
+from PIL import Image, ImageOps
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import coordinate_from_string
+from openpyxl.utils.exceptions import CellCoordinatesException
+from openpyxl.utils.indexed_list import IndexedList
 import aiosmtplib
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as pads
+    import pyarrow.parquet as pq
+except ImportError:  # Analytics snapshot disabled
+    pa = None
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 import json
+import jwt
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -39,6 +74,72 @@ EXCEL_TEMPLATE_PATH = ROOT_DIR.parent / "excel_template.xlsm"
 GENERATED_FILES_PATH = ROOT_DIR / "generated_files"
 GENERATED_FILES_PATH.mkdir(exist_ok=True)
 
+# Excel rendering pool ("thread" or "process")
+EXCEL_POOL_MODE = os.environ.get('EXCEL_POOL_MODE', 'thread')
+EXCEL_WORKERS = int(os.environ.get('EXCEL_WORKERS', '2'))
+EXCEL_MAX_QUEUE = int(os.environ.get('EXCEL_MAX_QUEUE', '20'))
+
+# Photo processing pool and output sizes
+PHOTO_POOL_MODE = os.environ.get('PHOTO_POOL_MODE', 'thread')
+PHOTO_WORKERS = int(os.environ.get('PHOTO_WORKERS', '2'))
+PHOTO_MAX_QUEUE = int(os.environ.get('PHOTO_MAX_QUEUE', '20'))
+PHOTO_THUMBNAIL_PX = int(os.environ.get('PHOTO_THUMBNAIL_PX', '320'))
+PHOTO_ATTACHMENT_PX = int(os.environ.get('PHOTO_ATTACHMENT_PX', '1600'))
+PHOTO_JPEG_QUALITY = int(os.environ.get('PHOTO_JPEG_QUALITY', '80'))
+
+# Rendered report cache: "disk" keeps reports in memory and generated_files/cache/,
+# "memory" keeps them in memory only (re-rendered on demand after eviction or restart).
+# Budgets are tracked per process: with N uvicorn workers the disk cache can reach N x EXCEL_CACHE_DISK_MB.
+EXCEL_STORAGE_MODE = os.environ.get('EXCEL_STORAGE_MODE', 'disk')
+EXCEL_CACHE_MEMORY_MB = int(os.environ.get('EXCEL_CACHE_MEMORY_MB', '32'))
+EXCEL_CACHE_DISK_MB = int(os.environ.get('EXCEL_CACHE_DISK_MB', '256'))
+EXCEL_MEDIA_TYPE = "application/vnd.ms-excel.sheet.macroEnabled.12"
+
+# Bulk export
+EXPORT_CHUNK_SIZE = 64 * 1024
+# CSV/NDJSON export: fiches per cursor batch (and per streamed chunk), action columns per row
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+EXPORT_MAX_ACTIONS = int(os.environ.get('EXPORT_MAX_ACTIONS', '10'))
+
+# Parquet analytics snapshot (needs pyarrow): location and refresh period in seconds (0 disables the job)
+ANALYTICS_SNAPSHOT_PATH = Path(os.environ.get('ANALYTICS_SNAPSHOT_PATH', str(GENERATED_FILES_PATH / "analytics")))
+ANALYTICS_SNAPSHOT_INTERVAL = int(os.environ.get('ANALYTICS_SNAPSHOT_INTERVAL', '900'))
+
+# Analytics results kept in process (keyed on the query and the fiches data version)
+ANALYTICS_CACHE_SIZE = int(os.environ.get('ANALYTICS_CACHE_SIZE', '256'))
+
+# Statistics counters reconciliation period in seconds (0 disables the periodic job)
+STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', '3600'))
+
+# Delta sync: tombstones of deleted fiches are kept this many days, and changes newer
+# than the lag are held back so writes still in flight are not skipped by a watermark
+SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', '90'))
+SYNC_CHANGES_LAG_SECONDS = int(os.environ.get('SYNC_CHANGES_LAG_SECONDS', '5'))
+
+# E-mail outbox: concurrent deliveries, retries with exponential backoff, idle poll period
+EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', '2'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '6'))
+EMAIL_RETRY_BASE_SECONDS = int(os.environ.get('EMAIL_RETRY_BASE_SECONDS', '30'))
+EMAIL_RETRY_MAX_SECONDS = int(os.environ.get('EMAIL_RETRY_MAX_SECONDS', '3600'))
+EMAIL_SEND_TIMEOUT = int(os.environ.get('EMAIL_SEND_TIMEOUT', '60'))
+EMAIL_POLL_SECONDS = int(os.environ.get('EMAIL_POLL_SECONDS', '5'))
+
+# Pooled SMTP sessions: closed after this idle time, probed with NOOP when idle longer than the check delay
+EMAIL_SMTP_IDLE_SECONDS = int(os.environ.get('EMAIL_SMTP_IDLE_SECONDS', '120'))
+EMAIL_SMTP_CHECK_SECONDS = int(os.environ.get('EMAIL_SMTP_CHECK_SECONDS', '10'))
+
+# How often due digest e-mails are looked for
+EMAIL_DIGEST_CHECK_SECONDS = int(os.environ.get('EMAIL_DIGEST_CHECK_SECONDS', '60'))
+
+# Cached config documents are revalidated against their stored version after this delay
+CONFIG_CACHE_CHECK_SECONDS = float(os.environ.get('CONFIG_CACHE_CHECK_SECONDS', '5'))
+
+# User lookups cache and session tokens (SESSION_SECRET unset: a key is generated and kept in Mongo)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '1000'))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '300'))
+SESSION_SECRET = os.environ.get('SESSION_SECRET')
+SESSION_TOKEN_HOURS = int(os.environ.get('SESSION_TOKEN_HOURS', '12'))
+
 # ===================== MODELS =====================
 
 class User(BaseModel):
@@ -62,8 +163,11 @@ class UserLogin(BaseModel):
 
 class Photo(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    data: str  # Base64 encoded
+    data: Optional[str] = None  # Base64 encoded, only until stored in GridFS
     filename: str
+    content_type: str = "image/jpeg"
+    size: Optional[int] = None
+    variants: Optional[List[str]] = None  # Generated JPEG variants, None until processed
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ActionCorrective(BaseModel):
@@ -160,6 +264,25 @@ class FicheQSE(BaseModel):
     created_by: str
     excel_filename: Optional[str] = None
     sync_status: str = "pending"  # "pending", "synced", "failed"
+    client_id: Optional[str] = None  # Idempotency key of fiches created through /sync
+
+class FicheSummary(BaseModel):
+    """Fiche fields needed by list screens (no photos, signature or causes)"""
+    id: str
+    type: str
+    date_evenement: datetime
+    heure_evenement: str
+    constate_par: str
+    service_emetteur: str
+    service_concerne: Optional[str] = None
+    description: str
+    criticite: str
+    statut: str = "Brouillon"
+    created_at: datetime
+    updated_at: datetime
+    created_by: str
+    excel_filename: Optional[str] = None
+    sync_status: str = "pending"
 
 class FicheCreate(BaseModel):
     type: str
@@ -213,6 +336,9 @@ class FicheCreate(BaseModel):
     signature: Optional[str] = None
     created_by: str
 
+class SyncFiche(FicheCreate):
+    client_id: Optional[str] = None  # Generated on the device; makes retried syncs idempotent
+
 class EmailConfig(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     smtp_server: str = "smtp.gmail.com"
@@ -222,6 +348,25 @@ class EmailConfig(BaseModel):
     use_tls: bool = True
     default_recipients: List[str] = []
     auto_recipients_by_service: Dict[str, List[str]] = {}
+    # Digest mode: fiches are grouped per recipient over the window, except these criticités
+    digest_enabled: bool = False
+    digest_window_minutes: int = 480
+    digest_immediate_criticites: List[str] = ["Critique"]
+
+class OutboxEmail(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    kind: str = "fiche"  # "fiche" or "digest"
+    fiche_id: Optional[str] = None
+    fiche_ids: List[str] = []  # Fiches listed in a digest
+    recipients: List[str]
+    status: str = "pending"  # "pending", "sending", "sent", "failed"
+    attempts: int = 0
+    last_error: Optional[str] = None
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    locked_until: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
 
 class ConfigData(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -238,6 +383,123 @@ class ConfigData(BaseModel):
     types_action: List[str] = []
     statuts_action: List[str] = []
 
+# ===================== INDEXES =====================
+
+# Listing filters on statut / type / service_emetteur (equality) and a
+# date_evenement range, sorted by (created_at, id) for keyset pagination.
+FICHE_INDEXES = [
+    IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    IndexModel([("updated_at", ASCENDING), ("id", ASCENDING)], name="updated_at_id"),
+    IndexModel([("statut", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="statut_created_at"),
+    IndexModel([("type", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="type_created_at"),
+    IndexModel([("service_emetteur", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="service_created_at"),
+    IndexModel([("date_evenement", ASCENDING)], name="date_evenement"),
+    IndexModel([("statut", ASCENDING), ("date_evenement", ASCENDING)], name="statut_date"),
+    IndexModel([("type", ASCENDING), ("date_evenement", ASCENDING)], name="type_date"),
+    IndexModel([("service_emetteur", ASCENDING), ("type", ASCENDING), ("date_evenement", ASCENDING)], name="service_type_date"),
+    # Retried posts reuse photo ids: blobs are only deleted once no fiche references them
+    IndexModel([("photos.id", ASCENDING)], name="photos_id"),
+]
+
+# Full-text search (French stemming, accents ignored): searched fields and their weight in the ranking
+FICHE_TEXT_WEIGHTS = {
+    "description": 10,
+    "cause_main_oeuvre": 5, "cause_materiel": 5, "cause_methode": 5, "cause_milieu": 5, "cause_matiere": 5,
+    "actions_correctives.action": 5,
+    "numero_lot": 5, "numero_palette": 5, "code_sca": 5, "reference_interne": 5, "numero_bobine": 5,
+    "autres_tracabilite": 3, "produit": 3, "ligne": 3, "defaut": 3, "categorie_corps_etranger": 3,
+    "traitement_autres": 2,
+}
+FICHE_INDEXES.append(IndexModel(
+    [(field, TEXT) for field in FICHE_TEXT_WEIGHTS], name="fiche_text", weights=FICHE_TEXT_WEIGHTS,
+    default_language="french", language_override="text_language",
+))
+
+# Every index the application relies on, per collection
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("code", ASCENDING)], name="code_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "fiches": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("client_id", ASCENDING)], name="client_id_unique", unique=True,
+            partialFilterExpression={"client_id": {"$type": "string"}},
+        ),
+    ] + FICHE_INDEXES,
+    "config": [IndexModel([("id", ASCENDING)], name="id_unique", unique=True)],
+    "email_config": [IndexModel([("id", ASCENDING)], name="id_unique", unique=True)],
+    "fiche_tombstones": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("deleted_at", ASCENDING), ("id", ASCENDING)], name="deleted_at_id"),
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_at_ttl", expireAfterSeconds=SYNC_TOMBSTONE_DAYS * 86400),
+    ],
+    "email_outbox": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt"),
+        IndexModel([("fiche_id", ASCENDING), ("status", ASCENDING)], name="fiche_status"),
+        # At most one fiche e-mail waiting per fiche, so concurrent sends queue it once
+        IndexModel(
+            [("fiche_id", ASCENDING)], name="fiche_active_unique", unique=True,
+            partialFilterExpression={"kind": "fiche", "status": {"$in": ["pending", "sending"]}},
+        ),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        IndexModel([("fiche_ids", ASCENDING)], name="fiche_ids"),
+    ],
+    "email_digest_queue": [
+        IndexModel([("digest_id", ASCENDING), ("recipient", ASCENDING), ("due_at", ASCENDING)], name="digest_recipient_due"),
+        # A fiche waits at most once per recipient and digest, even when sent concurrently
+        IndexModel(
+            [("recipient", ASCENDING), ("fiche_id", ASCENDING), ("digest_id", ASCENDING)],
+            name="recipient_fiche_digest_unique", unique=True,
+        ),
+    ],
+    "app_secrets": [IndexModel([("id", ASCENDING)], name="id_unique", unique=True)],
+    "fiche_stats": [
+        IndexModel([("dimension", ASCENDING), ("value", ASCENDING)], name="dimension_value_unique", unique=True),
+    ],
+}
+
+# Outcome of the last ensure_indexes() run: {collection: {index name: "ok" or error}}
+index_build_status: Dict[str, Dict[str, str]] = {}
+
+async def ensure_indexes():
+    """Create missing required indexes; failures (e.g. duplicate codes) are logged, not fatal"""
+    for collection, indexes in REQUIRED_INDEXES.items():
+        status = index_build_status.setdefault(collection, {})
+        for index in indexes:
+            name = index.document["name"]
+            try:
+                await db[collection].create_indexes([index])
+                status[name] = "ok"
+            except OperationFailure as e:
+                status[name] = str(e)
+                logging.error(f"Index {collection}.{name} could not be created: {e}")
+
+async def index_report() -> Dict[str, Any]:
+    """Declared vs existing indexes per collection, with usage counters when available"""
+    report = {}
+    for collection, indexes in REQUIRED_INDEXES.items():
+        existing = await db[collection].index_information()
+        declared = [index.document["name"] for index in indexes]
+        try:
+            stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+            usage = {stat["name"]: stat["accesses"]["ops"] for stat in stats}
+        except OperationFailure:
+            usage = None
+
+        report[collection] = {
+            "missing": [name for name in declared if name not in existing],
+            "undeclared": [name for name in existing if name != "_id_" and name not in declared],
+            "unused": [name for name in existing if usage is not None and usage.get(name) == 0],
+            "usage": usage,
+            "build_errors": {
+                name: error for name, error in index_build_status.get(collection, {}).items() if error != "ok"
+            },
+        }
+    return report
+
 # ===================== DEFAULT DATA =====================
 
 DEFAULT_CONFIG = {
@@ -306,6 +568,1041 @@ DEFAULT_CONFIG = {
     "statuts_action": ["Close", "En cours", "A lancer"]
 }
 
+# ===================== EXCEL LAYOUTS =====================
+
+# Declarative cell mapping for each ENS sheet, keyed by fiche type.
+#   cells:    (cell, source) where source is a FicheQSE field or an EXCEL_COMPUTED_VALUES key
+#   choices:  field -> {value: cell} ticked when the field equals the value
+#   keywords: field -> {keyword: cell} ticked when the keyword appears in the field
+#   flags:    (cell, field) ticked when the boolean field is true
+#   actions:  one {ActionCorrective attribute: cell} dict per corrective action slot
+# Layouts are validated against the template and compiled into resolved
+# write operations each time a template version is loaded.
+
+EXCEL_CHECK_MARK = "X"
+
+EXCEL_COMPUTED_VALUES = {
+    "date_evenement_fr": lambda fiche: fiche.date_evenement.strftime("%d/%m/%Y"),
+    "causes_texte": lambda fiche: (
+        f"Main d'œuvre: {fiche.cause_main_oeuvre or ''}\n"
+        f"Matériel: {fiche.cause_materiel or ''}\n"
+        f"Méthode: {fiche.cause_methode or ''}\n"
+        f"Milieu: {fiche.cause_milieu or ''}"
+    ),
+}
+
+EXCEL_SHEET_LAYOUTS = {
+    "Qualité": {
+        "sheet": "ENS Qualité",
+        "cells": [
+            ("E6", "date_evenement_fr"), ("G6", "heure_evenement"), ("L6", "constate_par"),
+            ("E7", "service_emetteur"), ("M7", "service_concerne"),
+            # Identification
+            ("G9", "non_conformite_constatee"), ("G10", "defaut"), ("G11", "ccp_prpo"),
+            ("G12", "categorie_corps_etranger"), ("G13", "quantite_concernee"),
+            # Traceability
+            ("G14", "produit"), ("L14", "numero_lot"),
+            ("G15", "grammage"), ("L15", "numero_palette"),
+            ("G16", "marque"), ("L16", "code_sca"),
+            ("G17", "ligne"), ("L17", "reference_interne"),
+            ("G18", "ddm"), ("L18", "date_production"),
+            ("G19", "quantieme"), ("L19", "numero_bobine"),
+            ("G20", "heure_production"), ("L20", "autres_tracabilite"),
+            ("D22", "description"),
+            ("N31", "impact_securite_aliments"),
+            # Treatment
+            ("J39", "traitement_autres"), ("E41", "date_traitement"), ("L41", "nom_traitement"),
+            # Causes (5M)
+            ("G43", "cause_main_oeuvre"), ("G44", "cause_materiel"), ("G45", "cause_methode"),
+            ("G46", "cause_milieu"), ("G47", "cause_matiere"),
+        ],
+        "choices": {
+            "criticite": {"Mineure": "H30", "Majeure": "L30", "Critique": "N30"},
+        },
+        "keywords": {},
+        "flags": [
+            ("E35", "traitement_blocage"), ("J35", "traitement_methanisation"),
+            ("E37", "traitement_fonte"), ("J37", "traitement_analyses"),
+            ("E39", "traitement_alimentation_animale"),
+        ],
+        "actions": [
+            {"action": f"E{row}", "responsable": f"J{row}", "delai": f"L{row}", "statut": f"N{row}"}
+            for row in range(51, 56)
+        ],
+    },
+    "Sécurité": {
+        "sheet": "ENS Sécurité",
+        "cells": [
+            ("E6", "date_evenement_fr"), ("L6", "constate_par"), ("E7", "service_emetteur"),
+            ("D17", "description"),
+            ("G24", "regle_or"),
+            ("D26", "causes_texte"),
+            # Redaction
+            ("E35", "date_evenement_fr"), ("L35", "constate_par"),
+        ],
+        "choices": {
+            "type_incident": {
+                "Presqu'accident": "E9",
+                "Risques psychosociaux": "N9",
+                "Situation dangereuse": "E12",
+                "Acte dangereux": "E14",
+                "Impact environnemental": "N15",
+            },
+        },
+        "keywords": {},
+        "flags": [],
+        # The form has two action lines; a third action shares the second line
+        "actions": [
+            {"action": "E31", "responsable": "J31", "delai": "L31"},
+            {"action": "E32", "responsable": "J32", "delai": "L32"},
+            {"action": "E32", "responsable": "J33", "delai": "L33"},
+        ],
+    },
+    "Environnement": {
+        "sheet": "ENS Environnement Energie",
+        "cells": [
+            ("E6", "date_evenement_fr"), ("L6", "constate_par"), ("E7", "service_emetteur"),
+            ("D18", "description"),
+            # Causes
+            ("G35", "cause_main_oeuvre"), ("G36", "cause_materiel"), ("G37", "cause_methode"),
+            ("G38", "cause_milieu"), ("G39", "cause_matiere"),
+            # Redaction
+            ("E46", "date_evenement_fr"), ("L46", "constate_par"),
+        ],
+        "choices": {
+            "criticite": {"Mineure": "H26", "Majeure": "L26", "Critique": "N26"},
+        },
+        "keywords": {
+            "type_env": {"Eaux": "E10", "Air": "E13", "Sol": "E15", "Déchets": "N10"},
+        },
+        "flags": [],
+        "actions": [],
+    },
+}
+
+# Sheet used for fiche types without a layout of their own
+EXCEL_DEFAULT_LAYOUT = "Environnement"
+
+def _value_getter(source: str):
+    if source in EXCEL_COMPUTED_VALUES:
+        return EXCEL_COMPUTED_VALUES[source]
+    return lambda fiche: getattr(fiche, source)
+
+def _choice_getter(field: str, expected: str):
+    return lambda fiche: EXCEL_CHECK_MARK if getattr(fiche, field) == expected else None
+
+def _keyword_getter(field: str, keyword: str):
+    def get_value(fiche):
+        value = getattr(fiche, field)
+        return EXCEL_CHECK_MARK if value and keyword in value else None
+    return get_value
+
+def _flag_getter(field: str):
+    return lambda fiche: EXCEL_CHECK_MARK if getattr(fiche, field) else None
+
+def _action_getter(index: int, attribute: str):
+    def get_value(fiche):
+        actions = fiche.actions_correctives
+        return getattr(actions[index], attribute) if index < len(actions) else None
+    return get_value
+
+class CompiledSheetLayout:
+    """Flat list of (cell, anchor, get_value) write operations for one sheet"""
+
+    def __init__(self, fiche_type: str, sheet: str, operations: list):
+        self.fiche_type = fiche_type
+        self.sheet = sheet
+        self.operations = operations
+
+    def fill(self, ws, fiche: FicheQSE):
+        for _, anchor, get_value in self.operations:
+            value = get_value(fiche)
+            if value is not None:
+                ws[anchor] = value
+
+def compile_sheet_layouts(workbook, merged_index: Dict[str, Dict[str, str]]) -> Dict[str, CompiledSheetLayout]:
+    """Validate EXCEL_SHEET_LAYOUTS against a template and resolve every cell to its anchor.
+
+    Raises ValueError listing every problem found.
+    """
+    fiche_fields = set(FicheQSE.model_fields)
+    action_fields = set(ActionCorrective.model_fields)
+    errors = []
+    compiled = {}
+
+    def check_cell(fiche_type, cell):
+        try:
+            coordinate_from_string(cell)
+        except (CellCoordinatesException, ValueError):
+            errors.append(f"{fiche_type}: cellule invalide '{cell}'")
+            return False
+        return True
+
+    def check_field(fiche_type, field, allow_computed=False):
+        if field in fiche_fields or (allow_computed and field in EXCEL_COMPUTED_VALUES):
+            return True
+        errors.append(f"{fiche_type}: champ inconnu '{field}'")
+        return False
+
+    for fiche_type, layout in EXCEL_SHEET_LAYOUTS.items():
+        sheet = layout["sheet"]
+        if sheet not in workbook.sheetnames:
+            errors.append(f"{fiche_type}: feuille '{sheet}' absente du template")
+            continue
+
+        entries = []
+        for cell, source in layout["cells"]:
+            if check_cell(fiche_type, cell) and check_field(fiche_type, source, allow_computed=True):
+                entries.append((cell, _value_getter(source)))
+        for field, cells in layout["choices"].items():
+            for expected, cell in cells.items():
+                if check_cell(fiche_type, cell) and check_field(fiche_type, field):
+                    entries.append((cell, _choice_getter(field, expected)))
+        for field, cells in layout["keywords"].items():
+            for keyword, cell in cells.items():
+                if check_cell(fiche_type, cell) and check_field(fiche_type, field):
+                    entries.append((cell, _keyword_getter(field, keyword)))
+        for cell, field in layout["flags"]:
+            if check_cell(fiche_type, cell) and check_field(fiche_type, field):
+                entries.append((cell, _flag_getter(field)))
+        for index, slot in enumerate(layout["actions"]):
+            for attribute, cell in slot.items():
+                if attribute not in action_fields:
+                    errors.append(f"{fiche_type}: attribut d'action inconnu '{attribute}'")
+                elif check_cell(fiche_type, cell):
+                    entries.append((cell, _action_getter(index, attribute)))
+
+        sheet_index = merged_index.get(sheet, {})
+        operations = [(cell, sheet_index.get(cell, cell), get_value) for cell, get_value in entries]
+        compiled[fiche_type] = CompiledSheetLayout(fiche_type, sheet, operations)
+
+    if EXCEL_DEFAULT_LAYOUT not in EXCEL_SHEET_LAYOUTS:
+        errors.append(f"Mise en page par défaut inconnue '{EXCEL_DEFAULT_LAYOUT}'")
+    if errors:
+        raise ValueError("Mise en page Excel invalide: " + "; ".join(errors))
+    return compiled
+
+# ===================== EXCEL TEMPLATE CACHE =====================
+
+def build_merged_cell_index(workbook) -> Dict[str, Dict[str, str]]:
+    """Map every cell covered by a merged range to the range's top-left cell, per sheet"""
+    index = {}
+    for ws in workbook.worksheets:
+        sheet_index = {}
+        for merged_range in ws.merged_cells.ranges:
+            anchor = f"{get_column_letter(merged_range.min_col)}{merged_range.min_row}"
+            for row in range(merged_range.min_row, merged_range.max_row + 1):
+                for col in range(merged_range.min_col, merged_range.max_col + 1):
+                    sheet_index[f"{get_column_letter(col)}{row}"] = anchor
+        index[ws.title] = sheet_index
+    return index
+
+class ExcelTemplateCache:
+    """Parses the Excel template once and hands out independent copies.
+
+    The parsed workbook is kept in memory and invalidated when the template
+    file changes (mtime/size first, then content hash). Each call to
+    get_workbook() returns a deep copy that can be filled and saved without
+    touching the cached master.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._workbook = None
+        self._layouts = None
+        self._stat_signature = None
+        self.version: Optional[str] = None
+        self.load_seconds = 0.0
+        self.loads = 0
+        self.hits = 0
+        self.copy_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def _refresh(self):
+        stat = self.path.stat()
+        stat_signature = (stat.st_mtime_ns, stat.st_size)
+        if self._workbook is not None and stat_signature == self._stat_signature:
+            return False
+
+        data = self.path.read_bytes()
+        version = hashlib.sha256(data).hexdigest()[:16]
+        self._stat_signature = stat_signature
+        if self._workbook is not None and version == self.version:
+            # File touched but content unchanged
+            return False
+
+        start = time.perf_counter()
+        workbook = load_workbook(io.BytesIO(data), keep_vba=True)
+        layouts = compile_sheet_layouts(workbook, build_merged_cell_index(workbook))
+        self.load_seconds = time.perf_counter() - start
+        self._workbook = workbook
+        self._layouts = layouts
+        self.version = version
+        self.loads += 1
+        logging.info(f"Excel template loaded (version {version}) in {self.load_seconds * 1000:.0f} ms")
+        return True
+
+    def _clone(self, workbook):
+        # openpyxl style tables (IndexedList) do not survive deepcopy, and the
+        # VBA archive is only read on save, so both are handled up front.
+        memo = {}
+        if workbook.vba_archive is not None:
+            memo[id(workbook.vba_archive)] = workbook.vba_archive
+        for value in vars(workbook).values():
+            if isinstance(value, IndexedList):
+                memo[id(value)] = IndexedList(value)
+        return copy.deepcopy(workbook, memo)
+
+    def preload(self):
+        """Parse the template and compile the sheet layouts now (startup check)"""
+        with self._lock:
+            self._refresh()
+
+    def get_layouts(self):
+        """Return the current template version and its compiled sheet layouts"""
+        with self._lock:
+            self._refresh()
+            return self.version, self._layouts
+
+    def get_workbook(self):
+        """Return a fresh copy of the template and its compiled sheet layouts.
+
+        The layouts are shared between copies and must not be modified.
+        """
+        with self._lock:
+            loaded = self._refresh()
+            workbook = self._workbook
+            layouts = self._layouts
+            version = self.version
+
+        start = time.perf_counter()
+        clone = self._clone(workbook)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.copy_seconds += elapsed
+            if not loaded and version == self.version:
+                self.hits += 1
+                self.saved_seconds += max(self.load_seconds - elapsed, 0.0)
+        return clone, layouts
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.loads + self.hits
+            return {
+                "template_version": self.version,
+                "loads": self.loads,
+                "hits": self.hits,
+                "load_ms": round(self.load_seconds * 1000, 1),
+                "avg_copy_ms": round(self.copy_seconds / requests * 1000, 1) if requests else 0.0,
+                "avg_saved_ms": round(self.saved_seconds / self.hits * 1000, 1) if self.hits else 0.0,
+                "total_saved_ms": round(self.saved_seconds * 1000, 1),
+            }
+
+excel_template_cache = ExcelTemplateCache(EXCEL_TEMPLATE_PATH)
+
+# ===================== WORKER POOLS =====================
+
+def _timed_call(func, *args):
+    """Run func in a worker and report when it started and finished"""
+    started = time.time()
+    result = func(*args)
+    return result, started, time.time()
+
+class WorkerPool:
+    """Runs blocking work (Excel rendering, image processing) outside the event loop.
+
+    At most `max_workers` jobs run at once; up to `max_queue` more may
+    wait for a worker. Beyond that, requests are rejected with a 503 so
+    the API stays responsive during peaks. Background work (exports)
+    passes wait=True: it waits for a free worker instead, and leaves the
+    queue places to interactive requests.
+    """
+
+    def __init__(self, name: str, mode: str, max_workers: int, max_queue: int, busy_detail: str):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Mode de pool invalide pour {name}: {mode}")
+        self.name = name
+        self.busy_detail = busy_detail
+        self.mode = mode
+        self.max_workers = max(max_workers, 1)
+        self.max_queue = max(max_queue, 0)
+        self._executor = None
+        self._waiters: List[asyncio.Future] = []
+        self.in_flight = 0
+        self.jobs = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    async def run(self, func, *args, wait: bool = False):
+        while self.in_flight >= self.max_workers + (0 if wait else self.max_queue):
+            if not wait:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail=self.busy_detail,
+                    headers={"Retry-After": "5"}
+                )
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_waiter()  # Woken but leaving: pass the place on
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+        self.in_flight += 1
+        submitted = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, finished = await loop.run_in_executor(self._get_executor(), _timed_call, func, *args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._wake_waiter()
+
+        wait_seconds = max(started - submitted, 0.0)
+        run_seconds = finished - started
+        self.jobs += 1
+        self.total_wait_seconds += wait_seconds
+        self.total_run_seconds += run_seconds
+        self.max_run_seconds = max(self.max_run_seconds, run_seconds)
+        logging.info(f"{self.name} job done: wait {wait_seconds * 1000:.0f} ms, run {run_seconds * 1000:.0f} ms")
+        return result
+
+    def _wake_waiter(self):
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": max(self.in_flight - self.max_workers, 0),
+            "waiting": len(self._waiters),
+            "jobs": self.jobs,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait_seconds / self.jobs * 1000, 1) if self.jobs else 0.0,
+            "avg_run_ms": round(self.total_run_seconds / self.jobs * 1000, 1) if self.jobs else 0.0,
+            "max_run_ms": round(self.max_run_seconds * 1000, 1),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+excel_render_pool = WorkerPool(
+    "excel", EXCEL_POOL_MODE, EXCEL_WORKERS, EXCEL_MAX_QUEUE,
+    "Génération Excel saturée, réessayez dans quelques secondes"
+)
+photo_pool = WorkerPool(
+    "photo", PHOTO_POOL_MODE, PHOTO_WORKERS, PHOTO_MAX_QUEUE,
+    "Traitement des photos saturé, réessayez dans quelques secondes"
+)
+
+# ===================== SMTP POOL =====================
+
+class SmtpConnectionPool:
+    """Authenticated SMTP sessions reused across e-mails.
+
+    Sessions are keyed on the SMTP settings: when the EmailConfig changes, idle sessions
+    are closed and busy ones are dropped on release. Sessions idle longer than
+    `check_after` are probed with NOOP before reuse, and closed after `idle_timeout`.
+    """
+
+    def __init__(self, max_size: int, idle_timeout: float, check_after: float):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._idle: List[Tuple[aiosmtplib.SMTP, float]] = []  # (session, released at), most recent last
+        self._settings: Optional[Tuple] = None
+        self._in_use = 0
+        self._opened = 0
+        self._reused = 0
+        self._closed = 0
+
+    @staticmethod
+    def settings_of(config: EmailConfig) -> Tuple:
+        return (config.smtp_server, config.smtp_port, config.smtp_user, config.smtp_password, config.use_tls)
+
+    async def _open(self, config: EmailConfig) -> aiosmtplib.SMTP:
+        # connect() negotiates STARTTLS when offered and logs in
+        smtp = aiosmtplib.SMTP(
+            hostname=config.smtp_server,
+            port=config.smtp_port,
+            username=config.smtp_user or None,
+            password=config.smtp_password or None,
+            use_tls=config.use_tls,
+            timeout=EMAIL_SEND_TIMEOUT
+        )
+        await smtp.connect()
+        self._opened += 1
+        return smtp
+
+    async def _close(self, smtp: aiosmtplib.SMTP):
+        self._closed += 1
+        try:
+            await smtp.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
+
+    async def _checkout(self, config: EmailConfig) -> aiosmtplib.SMTP:
+        settings = self.settings_of(config)
+        if settings != self._settings:
+            await self.close_all()
+            self._settings = settings
+        await self.close_idle()
+        
+        while self._idle:
+            smtp, released_at = self._idle.pop()
+            if not smtp.is_connected:
+                self._closed += 1
+                continue
+            if time.monotonic() - released_at > self.check_after:
+                try:
+                    await smtp.noop()
+                except (aiosmtplib.SMTPException, OSError):
+                    await self._close(smtp)
+                    continue
+            self._reused += 1
+            return smtp
+        return await self._open(config)
+
+    @asynccontextmanager
+    async def connection(self, config: EmailConfig):
+        async with self._semaphore:
+            smtp = await self._checkout(config)
+            self._in_use += 1
+            try:
+                yield smtp
+            except BaseException:
+                # The session state is unknown after a failed command
+                await self._close(smtp)
+                raise
+            else:
+                if self.settings_of(config) == self._settings and smtp.is_connected:
+                    self._idle.append((smtp, time.monotonic()))
+                else:
+                    await self._close(smtp)
+            finally:
+                self._in_use -= 1
+
+    async def close_idle(self):
+        """Close sessions idle for longer than the idle timeout"""
+        deadline = time.monotonic() - self.idle_timeout
+        expired = [smtp for smtp, released_at in self._idle if released_at < deadline]
+        self._idle = [(smtp, released_at) for smtp, released_at in self._idle if released_at >= deadline]
+        for smtp in expired:
+            await self._close(smtp)
+
+    async def close_all(self):
+        idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            await self._close(smtp)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_size": self.max_size,
+            "idle": len(self._idle),
+            "in_use": self._in_use,
+            "opened": self._opened,
+            "reused": self._reused,
+            "closed": self._closed,
+            "server": f"{self._settings[0]}:{self._settings[1]}" if self._settings else None,
+        }
+
+smtp_pool = SmtpConnectionPool(EMAIL_WORKERS, EMAIL_SMTP_IDLE_SECONDS, EMAIL_SMTP_CHECK_SECONDS)
+
+# ===================== CONFIG CACHE =====================
+
+class ConfigCache:
+    """Single-document configuration (config, email_config) cached in process.
+
+    Every write bumps the document's `version`. A cached copy is trusted for
+    `check_after` seconds, then revalidated with a read of its id and version
+    only, so a write made through another worker is seen within that delay.
+    """
+
+    def __init__(self, collection_name: str, check_after: float):
+        self.collection_name = collection_name
+        self.check_after = check_after
+        self._lock = asyncio.Lock()
+        self._doc: Optional[Dict[str, Any]] = None
+        self._stamp: Optional[Tuple[str, int]] = None
+        self._loaded = False
+        self._checked_at = 0.0
+        self._hits = 0
+        self._checks = 0
+        self._loads = 0
+
+    @staticmethod
+    def stamp_of(doc: Optional[Dict[str, Any]]) -> Optional[Tuple[str, int]]:
+        return (doc["id"], doc.get("version", 0)) if doc else None
+
+    def _fresh(self) -> bool:
+        return self._loaded and time.monotonic() - self._checked_at < self.check_after
+
+    async def get(self) -> Tuple[Optional[Tuple[str, int]], Optional[Dict[str, Any]]]:
+        """(id, version) stamp and a copy of the stored document; (None, None) when there is none"""
+        if not self._fresh():
+            async with self._lock:
+                if not self._fresh():
+                    await self._revalidate()
+        else:
+            self._hits += 1
+        return self._stamp, copy.deepcopy(self._doc)
+
+    async def _revalidate(self):
+        collection = db[self.collection_name]
+        if self._loaded:
+            self._checks += 1
+            stamp = self.stamp_of(await collection.find_one({}, {"_id": 0, "id": 1, "version": 1}))
+            if stamp == self._stamp:
+                self._checked_at = time.monotonic()
+                return
+        self._loads += 1
+        self._doc = await collection.find_one({}, {"_id": 0})
+        self._stamp = self.stamp_of(self._doc)
+        self._loaded = True
+        self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        self._loaded = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self._stamp[1] if self._stamp else None,
+            "hits": self._hits,
+            "checks": self._checks,
+            "loads": self._loads,
+        }
+
+config_cache = ConfigCache("config", CONFIG_CACHE_CHECK_SECONDS)
+email_config_cache = ConfigCache("email_config", CONFIG_CACHE_CHECK_SECONDS)
+
+# ===================== USER CACHE AND SESSIONS =====================
+
+class UserCache:
+    """Bounded LRU of users by id with a code index; entries expire after `ttl` seconds.
+
+    Users are only ever created, so the TTL just bounds how long another worker's
+    copy can lag; create_user seeds the cache of the worker that handled it.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # id -> (user, expires at)
+        self._ids_by_code: Dict[str, str] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def _cached(self, user_id: Optional[str]) -> Optional[User]:
+        entry = self._entries.get(user_id) if user_id else None
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if expires_at < time.monotonic():
+            self._drop(user_id)
+            return None
+        self._entries.move_to_end(user_id)
+        return user
+
+    def _drop(self, user_id: str):
+        user, _ = self._entries.pop(user_id, (None, 0))
+        if user and self._ids_by_code.get(user.code) == user_id:
+            del self._ids_by_code[user.code]
+
+    def put(self, user: User):
+        self._drop(user.id)
+        self._entries[user.id] = (user, time.monotonic() + self.ttl)
+        self._ids_by_code[user.code] = user.id
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    async def _lookup(self, cached: Optional[User], query: Dict[str, str]) -> Optional[User]:
+        if cached:
+            self._hits += 1
+            return cached
+        self._misses += 1
+        doc = await db.users.find_one(query)
+        if not doc:
+            return None
+        user = User(**doc)
+        self.put(user)
+        return user
+
+    async def by_id(self, user_id: str) -> Optional[User]:
+        return await self._lookup(self._cached(user_id), {"id": user_id})
+
+    async def by_code(self, code: str) -> Optional[User]:
+        return await self._lookup(self._cached(self._ids_by_code.get(code)), {"code": code})
+
+    def clear(self):
+        self._entries.clear()
+        self._ids_by_code.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self._hits, "misses": self._misses}
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+# HMAC key of session tokens: SESSION_SECRET, or a key generated once and shared through Mongo
+# (loaded at startup, or on first use when Mongo was unreachable then)
+session_secret: Optional[str] = SESSION_SECRET
+
+async def load_session_secret() -> str:
+    doc = await db.app_secrets.find_one_and_update(
+        {"id": "session"},
+        {"$setOnInsert": {"secret": secrets.token_urlsafe(32)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc["secret"]
+
+async def get_session_secret() -> str:
+    global session_secret
+    if not session_secret:
+        try:
+            session_secret = await load_session_secret()
+        except PyMongoError as e:
+            logging.error(f"Session secret could not be loaded: {e}")
+            raise HTTPException(status_code=503, detail="Base de données indisponible, réessayez plus tard")
+    return session_secret
+
+async def issue_session_token(user: User) -> str:
+    now = datetime.now(timezone.utc)
+    claims = {
+        "sub": user.id,
+        "user": user.model_dump(mode="json"),
+        "iat": now,
+        "exp": now + timedelta(hours=SESSION_TOKEN_HOURS),
+    }
+    return jwt.encode(claims, await get_session_secret(), algorithm="HS256")
+
+async def verify_session_token(token: str) -> User:
+    secret = await get_session_secret()
+    try:
+        claims = jwt.decode(token, secret, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Session expirée")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Session invalide")
+    return User(**claims["user"])
+
+async def session_user(authorization: Optional[str] = Header(None)) -> Optional[User]:
+    """User of the `Authorization: Bearer` session token, checked without reading the users collection"""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Session invalide")
+    return await verify_session_token(token.strip())
+
+# ===================== EXCEL REPORT CACHE =====================
+
+def excel_report_key(fiche: FicheQSE) -> str:
+    """Content address of a fiche report: template version plus every value written to the sheet.
+    May reload the template (stat, parse), so call it off the event loop."""
+    version, layouts = excel_template_cache.get_layouts()
+    layout = layouts.get(fiche.type) or layouts[EXCEL_DEFAULT_LAYOUT]
+    values = [(anchor, get_value(fiche)) for _, anchor, get_value in layout.operations]
+    payload = json.dumps([version, layout.sheet, values], default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ExcelReportCache:
+    """Size-bounded LRU of rendered reports, in memory and optionally on disk.
+
+    Reports are keyed by excel_report_key(), so validation, download and
+    e-mail reuse the same artifact until the rendered content changes.
+    Concurrent requests for the same key share a single render.
+    """
+
+    def __init__(self, memory_bytes: int, disk_path: Optional[Path], disk_bytes: int):
+        self.memory_bytes = memory_bytes
+        self.disk_path = disk_path
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.renders = 0
+
+        if self.disk_path is not None:
+            self.disk_path.mkdir(parents=True, exist_ok=True)
+            files = sorted(self.disk_path.glob("*.xlsm"), key=lambda f: f.stat().st_mtime)
+            for f in files:
+                size = f.stat().st_size
+                self._disk[f.stem] = size
+                self._disk_size += size
+
+    def _remember(self, key: str, content: bytes):
+        if key in self._memory or len(content) > self.memory_bytes:
+            return
+        self._memory[key] = content
+        self._memory_size += len(content)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    async def _store(self, key: str, content: bytes):
+        # File I/O runs in a thread; the index is only touched on the event loop
+        if self.disk_path is None or key in self._disk:
+            return
+        await asyncio.to_thread((self.disk_path / f"{key}.xlsm").write_bytes, content)
+        self._disk[key] = len(content)
+        self._disk_size += len(content)
+        evicted = []
+        while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+            name, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            evicted.append(self.disk_path / f"{name}.xlsm")
+        if evicted:
+            await asyncio.to_thread(lambda: [f.unlink(missing_ok=True) for f in evicted])
+
+    @staticmethod
+    def _read_disk(filepath: Path) -> bytes:
+        content = filepath.read_bytes()
+        os.utime(filepath)
+        return content
+
+    async def get(self, key: str, keep: bool = True) -> Optional[bytes]:
+        """Cached report; keep=False reads without refreshing or promoting the entry"""
+        content = self._memory.get(key)
+        if content is not None:
+            if keep:
+                self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return content
+
+        if key in self._disk:
+            try:
+                content = await asyncio.to_thread(self._read_disk, self.disk_path / f"{key}.xlsm")
+            except FileNotFoundError:
+                self._disk_size -= self._disk.pop(key, 0)
+                return None
+            if keep and key in self._disk:  # Not evicted while reading
+                self._disk.move_to_end(key)
+            self.disk_hits += 1
+            if keep:
+                self._remember(key, content)
+            return content
+        return None
+
+    async def put(self, key: str, content: bytes):
+        self._remember(key, content)
+        await self._store(key, content)
+
+    async def get_or_render(self, key: str, render, keep: bool = True):
+        """Cached report, or render it once for concurrent callers; keep=False (exports)
+        reads through the cache without storing or refreshing anything"""
+        content = await self.get(key, keep)
+        if content is not None:
+            return content
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            content = await asyncio.shield(pending)
+            if keep:  # The render may be an export's, which did not store it
+                await self.put(key, content)
+            return content
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            content = await render()
+            self.renders += 1
+            if keep:
+                await self.put(key, content)
+            future.set_result(content)
+            return content
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not logged twice
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "storage_mode": EXCEL_STORAGE_MODE,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "memory_limit_bytes": self.memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_size,
+            "disk_limit_bytes": self.disk_bytes if self.disk_path is not None else 0,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "renders": self.renders,
+        }
+
+excel_report_cache = ExcelReportCache(
+    EXCEL_CACHE_MEMORY_MB * 1024 * 1024,
+    GENERATED_FILES_PATH / "cache" if EXCEL_STORAGE_MODE == "disk" else None,
+    EXCEL_CACHE_DISK_MB * 1024 * 1024
+)
+
+# ===================== STATISTICS COUNTERS =====================
+
+# Dashboard keys for each stored statut
+STATS_STATUS_KEYS = {
+    "Brouillon": "brouillon",
+    "Validé": "valide",
+    "Envoyé": "envoye",
+    "Échec d'envoi": "echec",
+}
+STATS_TYPES = ["Qualité", "Sécurité", "Environnement"]
+
+# Counted dimensions and the fiche expression they group on
+STATS_DIMENSIONS = {
+    "statut": "$statut",
+    "type": "$type",
+    "service": "$service_emetteur",
+    "criticite": "$criticite",
+    "month": {"$dateToString": {"format": "%Y-%m", "date": "$date_evenement"}},
+}
+
+STATS_PIPELINE = [
+    {"$facet": {
+        "total": [{"$count": "count"}],
+        **{
+            dimension: [{"$group": {"_id": expression, "count": {"$sum": 1}}}]
+            for dimension, expression in STATS_DIMENSIONS.items()
+        },
+    }}
+]
+
+# Fields needed to know which counters a fiche contributes to
+STATS_PROJECTION = {"_id": 0, "statut": 1, "type": 1, "service_emetteur": 1, "criticite": 1, "date_evenement": 1}
+
+def fiche_stat_keys(fiche: Optional[Dict[str, Any]]) -> List[Tuple[str, Optional[str]]]:
+    """(dimension, value) counters a stored fiche contributes to"""
+    if not fiche:
+        return []
+    date_evenement = fiche.get("date_evenement")
+    values = {
+        "statut": fiche.get("statut"),
+        "type": fiche.get("type"),
+        "service": fiche.get("service_emetteur"),
+        "criticite": fiche.get("criticite"),
+        "month": date_evenement.strftime("%Y-%m") if isinstance(date_evenement, datetime) else None,
+    }
+    return [("total", None)] + [(dimension, value) for dimension, value in values.items() if value is not None]
+
+async def adjust_stats(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+    """Apply the counter changes of a fiche going from `before` to `after` (None = absent)"""
+    await adjust_stats_many([(before, after)])
+
+async def adjust_stats_many(changes: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]):
+    """Apply several (before, after) changes in one round trip.
+    A failure only leaves the counters stale until the next reconciliation."""
+    delta = Counter()
+    for before, after in changes:
+        delta.update(fiche_stat_keys(after))
+        delta.subtract(fiche_stat_keys(before))
+    operations = [
+        UpdateOne({"dimension": dimension, "value": value}, {"$inc": {"count": count}}, upsert=True)
+        for (dimension, value), count in delta.items() if count
+    ]
+    if not operations:
+        return
+    try:
+        await db.fiche_stats.bulk_write(operations, ordered=False)
+    except PyMongoError as e:
+        logging.error(f"Stats counters update failed: {e}")
+
+async def set_fiche_statut(fiche_id: str, statut: str, **fields):
+    """Change a fiche statut and move it between the statut counters"""
+    before = await db.fiches.find_one_and_update(
+        {"id": fiche_id},
+        {"$set": {"statut": statut, "updated_at": datetime.utcnow(), **fields}},
+        projection=STATS_PROJECTION,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before:
+        await adjust_stats(before, {**before, "statut": statut})
+
+async def rebuild_stats():
+    """Recount every dimension from the fiches collection and replace the counters"""
+    result = (await db.fiches.aggregate(STATS_PIPELINE).to_list(1))[0]
+    counts = {("total", None): result["total"][0]["count"] if result["total"] else 0}
+    for dimension in STATS_DIMENSIONS:
+        for row in result[dimension]:
+            if row["_id"] is not None:
+                counts[(dimension, row["_id"])] = row["count"]
+
+    await db.fiche_stats.bulk_write([
+        ReplaceOne(
+            {"dimension": dimension, "value": value},
+            {"dimension": dimension, "value": value, "count": count},
+            upsert=True,
+        )
+        for (dimension, value), count in counts.items()
+    ], ordered=False)
+
+    # Counters of values no fiche has anymore
+    stale = [
+        counter["_id"] async for counter in db.fiche_stats.find({}, {"dimension": 1, "value": 1})
+        if (counter["dimension"], counter.get("value")) not in counts
+    ]
+    if stale:
+        await db.fiche_stats.delete_many({"_id": {"$in": stale}})
+    logging.info(f"Stats counters rebuilt ({len(counts)} counters)")
+
+async def read_stats() -> Dict[str, Any]:
+    """Dashboard statistics from the counters collection"""
+    counters: Dict[str, Dict[Optional[str], int]] = {"total": {}, **{dimension: {} for dimension in STATS_DIMENSIONS}}
+    async for counter in db.fiche_stats.find({"count": {"$gt": 0}}, {"_id": 0}):
+        counters.setdefault(counter["dimension"], {})[counter.get("value")] = counter["count"]
+
+    return {
+        "total": counters["total"].get(None, 0),
+        "by_status": {key: counters["statut"].get(statut, 0) for statut, key in STATS_STATUS_KEYS.items()},
+        "by_type": {fiche_type: counters["type"].get(fiche_type, 0) for fiche_type in STATS_TYPES},
+        "by_service": counters["service"],
+        "by_criticite": counters["criticite"],
+        "by_month": dict(sorted(counters["month"].items())),
+    }
+
+async def reconcile_stats_periodically():
+    while True:
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+        try:
+            await rebuild_stats()
+        except PyMongoError as e:
+            logging.error(f"Stats counters reconciliation failed: {e}")
+
 # ===================== ROUTES =====================
 
 @api_router.get("/")
@@ -318,15 +1615,26 @@ async def root():
 async def create_user(user: UserCreate):
     user_dict = user.model_dump()
     user_obj = User(**user_dict)
-    await db.users.insert_one(user_obj.model_dump())
+    try:
+        await db.users.insert_one(user_obj.model_dump())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Code employé déjà utilisé")
+    user_cache.put(user_obj)
     return user_obj
 
 @api_router.post("/users/login")
 async def login_user(login: UserLogin):
-    user = await db.users.find_one({"code": login.code})
+    """User of the employee code, with a session token for the Authorization header"""
+    user = await user_cache.by_code(login.code)
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
-    return User(**user)
+    return {**user.model_dump(), "session_token": await issue_session_token(user)}
+
+@api_router.get("/users/me", response_model=User)
+async def get_current_user(user: Optional[User] = Depends(session_user)):
+    if not user:
+        raise HTTPException(status_code=401, detail="Session requise")
+    return user
 
 @api_router.get("/users", response_model=List[User])
 async def get_users():
@@ -335,10 +1643,10 @@ async def get_users():
 
 @api_router.get("/users/{user_id}", response_model=User)
 async def get_user(user_id: str):
-    user = await db.users.find_one({"id": user_id})
+    user = await user_cache.by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
-    return User(**user)
+    return user
 
 # ----- Fiches QSE -----
 
@@ -346,17 +1654,39 @@ async def get_user(user_id: str):
 async def create_fiche(fiche: FicheCreate):
     fiche_dict = fiche.model_dump()
     fiche_obj = FicheQSE(**fiche_dict)
-    await db.fiches.insert_one(fiche_obj.model_dump())
+    photo_ids = [photo.id for photo in fiche_obj.photos]
+    try:
+        fiche_obj.photos = await store_photos(fiche_obj.photos)
+        # Stamped once the photos are stored: delta sync only waits SYNC_CHANGES_LAG_SECONDS for in-flight writes
+        fiche_obj.created_at = fiche_obj.updated_at = datetime.utcnow()
+        fiche_doc = fiche_obj.model_dump()
+        await db.fiches.insert_one(fiche_doc)
+    except Exception:
+        await delete_photo_blobs(photo_ids)
+        raise
+    await adjust_stats(None, fiche_doc)
     return fiche_obj
 
-@api_router.get("/fiches", response_model=List[FicheQSE])
-async def get_fiches(
+def parse_date_filter(value: str, name: str, end: bool = False) -> Dict[str, datetime]:
+    """Mongo range condition for a YYYY-MM-DD (whole day) or ISO datetime bound"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Date invalide pour {name}: {value}")
+    if not end:
+        return {"$gte": parsed}
+    if len(value) == 10:
+        # Date only: include the whole day
+        return {"$lt": parsed + timedelta(days=1)}
+    return {"$lte": parsed}
+
+def build_fiche_query(
     statut: Optional[str] = None,
     type: Optional[str] = None,
     service: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None
-):
+) -> Dict[str, Any]:
     query = {}
     if statut:
         query["statut"] = statut
@@ -364,42 +1694,573 @@ async def get_fiches(
         query["type"] = type
     if service:
         query["service_emetteur"] = service
-    
-    fiches = await db.fiches.find(query).sort("created_at", -1).to_list(1000)
-    return [FicheQSE(**fiche) for fiche in fiches]
-
-@api_router.get("/fiches/{fiche_id}", response_model=FicheQSE)
-async def get_fiche(fiche_id: str):
-    fiche = await db.fiches.find_one({"id": fiche_id})
-    if not fiche:
-        raise HTTPException(status_code=404, detail="Fiche non trouvée")
-    return FicheQSE(**fiche)
+    if date_from or date_to:
+        date_range = {}
+        if date_from:
+            date_range.update(parse_date_filter(date_from, "date_from"))
+        if date_to:
+            date_range.update(parse_date_filter(date_to, "date_to", end=True))
+        query["date_evenement"] = date_range
+    return query
 
-@api_router.put("/fiches/{fiche_id}", response_model=FicheQSE)
-async def update_fiche(fiche_id: str, fiche: FicheCreate):
-    existing = await db.fiches.find_one({"id": fiche_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Fiche non trouvée")
-    
-    fiche_dict = fiche.model_dump()
-    fiche_dict["id"] = fiche_id
-    fiche_dict["updated_at"] = datetime.utcnow()
-    fiche_dict["created_at"] = existing["created_at"]
-    
-    await db.fiches.update_one({"id": fiche_id}, {"$set": fiche_dict})
-    updated = await db.fiches.find_one({"id": fiche_id})
-    return FicheQSE(**updated)
+FICHE_SUMMARY_PROJECTION = {field: 1 for field in FicheSummary.model_fields}
 
-@api_router.delete("/fiches/{fiche_id}")
-async def delete_fiche(fiche_id: str):
-    result = await db.fiches.delete_one({"id": fiche_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Fiche non trouvée")
-    return {"message": "Fiche supprimée"}
+def encode_fiche_cursor(fiche: Dict[str, Any]) -> str:
+    payload = json.dumps([fiche["created_at"].isoformat(), fiche["id"]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
 
-# ----- Validate and Generate Excel -----
+def decode_fiche_cursor(cursor: str) -> Dict[str, Any]:
+    """Keyset condition for the fiches after `cursor` in (created_at, id) descending order"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, fiche_id = json.loads(base64.urlsafe_b64decode(padded))
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": fiche_id}}
+    ]}
 
-@api_router.post("/fiches/{fiche_id}/validate")
+@api_router.get("/fiches", response_model=Union[List[FicheQSE], List[FicheSummary]])
+async def get_fiches(
+    response: Response,
+    statut: Optional[str] = None,
+    type: Optional[str] = None,
+    service: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    view: str = "full"
+):
+    """Newest fiches first, `limit` per page; date_from/date_to filter on date_evenement.
+
+    When more fiches match, the X-Next-Cursor header holds the cursor for
+    the next page. view=summary returns FicheSummary items only.
+    """
+    if view not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="Vue inconnue (full ou summary)")
+    
+    query = build_fiche_query(statut, type, service, date_from, date_to)
+    if cursor:
+        query = {"$and": [query, decode_fiche_cursor(cursor)]}
+    
+    projection = FICHE_SUMMARY_PROJECTION if view == "summary" else None
+    fiches = await db.fiches.find(query, projection).sort([("created_at", -1), ("id", -1)]).to_list(limit + 1)
+    if len(fiches) > limit:
+        fiches = fiches[:limit]
+        response.headers["X-Next-Cursor"] = encode_fiche_cursor(fiches[-1])
+    
+    model = FicheSummary if view == "summary" else FicheQSE
+    return [model(**fiche) for fiche in fiches]
+
+def encode_search_cursor(fiche: Dict[str, Any]) -> str:
+    payload = json.dumps([fiche["score"], fiche["created_at"].isoformat(), fiche["id"]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_search_cursor(cursor: str) -> Dict[str, Any]:
+    """Keyset condition for the matches after `cursor` in (score, created_at, id) descending order"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, created_at, fiche_id = json.loads(base64.urlsafe_b64decode(padded))
+        score = float(score)
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+    return {"$or": [
+        {"score": {"$lt": score}},
+        {"score": score, "created_at": {"$lt": created_at}},
+        {"score": score, "created_at": created_at, "id": {"$lt": fiche_id}}
+    ]}
+
+def fiche_search_cursor(q: str, query: Dict[str, Any], limit: int, cursor: Optional[str] = None, view: str = "summary"):
+    """Page of fiches matching the text search `q` and the filters, best matches first (then newest).
+
+    Paging is keyset on (score, created_at, id) so a deep page costs no more than the first.
+    """
+    after = [{"$match": decode_search_cursor(cursor)}] if cursor else []
+    projection = {**FICHE_SUMMARY_PROJECTION, "score": 1} if view == "summary" else {"_id": 0}
+    return db.fiches.aggregate([
+        {"$match": {"$text": {"$search": q}, **query}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+        *after,
+        {"$sort": {"score": -1, "created_at": -1, "id": -1}},
+        {"$limit": limit},
+        {"$project": projection},
+    ])
+
+@api_router.get("/fiches/search")
+async def search_fiches(
+    q: str,
+    statut: Optional[str] = None,
+    type: Optional[str] = None,
+    service: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    view: str = "summary"
+):
+    """Fiches matching `q` through the text index, best matches first (then newest).
+
+    Words are stemmed in French and accents ignored; "quoted text" requires the
+    phrase and -word excludes it. Each item carries its relevance `score`; pass
+    `next_cursor` back as `cursor` for the next page.
+    """
+    if view not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="Vue inconnue (full ou summary)")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Texte de recherche vide")
+
+    query = build_fiche_query(statut, type, service, date_from, date_to)
+    fiches = await fiche_search_cursor(q.strip(), query, limit + 1, cursor, view).to_list(limit + 1)
+    has_more = len(fiches) > limit
+    fiches = fiches[:limit]
+
+    model = FicheSummary if view == "summary" else FicheQSE
+    return {
+        "fiches": [{**model(**fiche).model_dump(), "score": round(fiche["score"], 3)} for fiche in fiches],
+        "has_more": has_more,
+        "next_cursor": encode_search_cursor(fiches[-1]) if has_more else None,
+    }
+
+# ----- Bulk Export -----
+
+EXPORT_SUMMARY_COLUMNS = [
+    ("ID", "id"), ("Type", "type"), ("Statut", "statut"), ("Date", "date_evenement"),
+    ("Heure", "heure_evenement"), ("Service émetteur", "service_emetteur"),
+    ("Service concerné", "service_concerne"), ("Constaté par", "constate_par"),
+    ("Criticité", "criticite"), ("Défaut", "defaut"), ("Corps étranger", "categorie_corps_etranger"),
+    ("Type d'incident", "type_incident"), ("Type de risque", "type_risque"), ("Règle d'or", "regle_or"),
+    ("Type environnement", "type_env"), ("Produit", "produit"), ("N° lot", "numero_lot"),
+    ("Description", "description"), ("Créée le", "created_at"),
+]
+
+class _ZipStream:
+    """Write-only sink for zipfile; the bytes written so far are taken with drain()"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+async def _export_report(fiche: FicheQSE) -> Tuple[Optional[bytes], Optional[str]]:
+    """Report bytes, or the error once the response has started and can no longer fail"""
+    try:
+        return await get_excel_content(fiche, export=True), None
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+        logging.error(f"Export of fiche {fiche.id} failed: {error}")
+        return None, error
+
+async def _export_batches(query: Dict[str, Any]):
+    """Yield fiches matching query in batches sized to the render pool"""
+    batch_size = excel_render_pool.max_workers * 2
+    cursor = db.fiches.find(query, {"photos": 0, "signature": 0}).sort("created_at", -1).batch_size(batch_size)
+    batch = []
+    async for fiche in cursor:
+        batch.append(FicheQSE(**fiche))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def stream_fiches_zip(query: Dict[str, Any]):
+    """ZIP of one .xlsm per fiche; at most one batch of reports is held in memory.
+
+    Failures are listed in errors.txt so the archive is always complete and valid.
+    """
+    sink = _ZipStream()
+    errors = []
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        try:
+            async for batch in _export_batches(query):
+                reports = await asyncio.gather(*[_export_report(fiche) for fiche in batch])
+                for fiche, (content, error) in zip(batch, reports):
+                    name = excel_filename_for(fiche).replace(".xlsm", f"_{fiche.id[:8]}.xlsm")
+                    if error is not None:
+                        errors.append(f"{name}: {error}")
+                        continue
+                    archive.writestr(name, content)
+                    yield sink.drain()
+        except PyMongoError as e:
+            logging.error(f"Export interrupted: {e}")
+            errors.append(f"Export interrompu, fiches suivantes manquantes: {e}")
+        if errors:
+            archive.writestr("errors.txt", "Rapports non générés\n" + "\n".join(errors) + "\n")
+    yield sink.drain()
+
+async def stream_fiches_summary(query: Dict[str, Any]):
+    """Single workbook with one row per fiche, written in openpyxl write-only mode"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Fiches QSE")
+    ws.append([title for title, _ in EXPORT_SUMMARY_COLUMNS])
+    async for batch in _export_batches(query):
+        for fiche in batch:
+            ws.append([getattr(fiche, field) for _, field in EXPORT_SUMMARY_COLUMNS])
+    
+    with tempfile.TemporaryFile() as f:
+        await asyncio.to_thread(wb.save, f)
+        f.seek(0)
+        while True:
+            chunk = f.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+# Flat row layout of the CSV/NDJSON exports: every stored field except photo and
+# signature payloads, with the corrective actions spread over numbered columns
+EXPORT_ROW_FIELDS = [
+    field for field in FicheQSE.model_fields if field not in ("photos", "signature", "actions_correctives")
+]
+EXPORT_ACTION_FIELDS = list(ActionCorrective.model_fields)
+EXPORT_ROW_COLUMNS = EXPORT_ROW_FIELDS + ["nb_actions"] + [
+    f"action_{index}_{field}" for index in range(1, EXPORT_MAX_ACTIONS + 1) for field in EXPORT_ACTION_FIELDS
+]
+
+def export_row(fiche: Dict[str, Any], iso_dates: bool = True) -> Dict[str, Any]:
+    """Flat export row of a raw fiche document"""
+    row = {field: fiche.get(field) for field in EXPORT_ROW_FIELDS}
+    actions = fiche.get("actions_correctives") or []
+    row["nb_actions"] = len(actions)
+    for index, action in enumerate(actions[:EXPORT_MAX_ACTIONS], start=1):
+        for field in EXPORT_ACTION_FIELDS:
+            row[f"action_{index}_{field}"] = action.get(field)
+    if iso_dates:
+        for key, value in row.items():
+            if isinstance(value, datetime):
+                row[key] = value.isoformat()
+    return row
+
+def csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return "; ".join(str(item) for item in value)
+    return value
+
+async def stream_fiches_rows(query: Dict[str, Any], format: str, delimiter: str):
+    """CSV or NDJSON rows, one cursor batch at a time so memory stays flat whatever the export size"""
+    projection = {"_id": 0, "photos": 0, "signature": 0}
+    cursor = db.fiches.find(query, projection).sort([("created_at", -1), ("id", -1)]).batch_size(EXPORT_BATCH_SIZE)
+    buffer = io.StringIO()
+    if format == "csv":
+        writer = csv.writer(buffer, delimiter=delimiter)
+        # BOM so that spreadsheet tools detect UTF-8
+        buffer.write("\ufeff")
+        writer.writerow(EXPORT_ROW_COLUMNS)
+    
+    rows = 0
+    async for fiche in cursor:
+        row = export_row(fiche)
+        if format == "csv":
+            writer.writerow([csv_value(row.get(column)) for column in EXPORT_ROW_COLUMNS])
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False))
+            buffer.write("\n")
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+@api_router.get("/fiches/export")
+async def export_fiches(
+    format: str = "zip",
+    statut: Optional[str] = None,
+    type: Optional[str] = None,
+    service: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    delimiter: str = ","
+):
+    """Bulk export: ZIP of the fiches' Excel reports, one summary workbook (format=xlsx),
+    or flat rows for BI tools (format=csv or ndjson)"""
+    query = build_fiche_query(statut, type, service, date_from, date_to)
+    stamp = datetime.utcnow().strftime("%Y%m%d_%H%M")
+    
+    if format == "zip":
+        check_excel_template()
+        return StreamingResponse(
+            stream_fiches_zip(query),
+            media_type="application/zip",
+            headers={"Content-Disposition": content_disposition(f"Fiches_QSE_{stamp}.zip")}
+        )
+    if format == "xlsx":
+        return StreamingResponse(
+            stream_fiches_summary(query),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={"Content-Disposition": content_disposition(f"Fiches_QSE_{stamp}.xlsx")}
+        )
+    if format in ("csv", "ndjson"):
+        if delimiter not in (",", ";"):
+            raise HTTPException(status_code=400, detail="Séparateur CSV inconnu (, ou ;)")
+        media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+        return StreamingResponse(
+            stream_fiches_rows(query, format, delimiter),
+            media_type=media_type,
+            headers={"Content-Disposition": content_disposition(f"Fiches_QSE_{stamp}.{format}")}
+        )
+    raise HTTPException(status_code=400, detail="Format d'export inconnu (zip, xlsx, csv ou ndjson)")
+
+@api_router.get("/fiches/{fiche_id}", response_model=FicheQSE)
+async def get_fiche(fiche_id: str):
+    fiche = await db.fiches.find_one({"id": fiche_id})
+    if not fiche:
+        raise HTTPException(status_code=404, detail="Fiche non trouvée")
+    return FicheQSE(**fiche)
+
+@api_router.put("/fiches/{fiche_id}", response_model=FicheQSE)
+async def update_fiche(fiche_id: str, fiche: FicheCreate):
+    existing = await db.fiches.find_one({"id": fiche_id})
+    if not existing:
+        raise HTTPException(status_code=404, detail="Fiche non trouvée")
+    
+    photos = await store_photos(fiche.photos)
+    fiche_dict = fiche.model_dump()
+    fiche_dict["photos"] = [photo.model_dump() for photo in photos]
+    fiche_dict["id"] = fiche_id
+    fiche_dict["updated_at"] = datetime.utcnow()
+    fiche_dict["created_at"] = existing["created_at"]
+    
+    before = await db.fiches.find_one_and_update(
+        {"id": fiche_id}, {"$set": fiche_dict}, projection=STATS_PROJECTION, return_document=ReturnDocument.BEFORE
+    )
+    if before:
+        await adjust_stats(before, {**before, **fiche_dict})
+    
+    # Photos removed from the fiche
+    kept = {photo.id for photo in photos}
+    await delete_photo_blobs([photo["id"] for photo in existing.get("photos", []) if photo["id"] not in kept])
+    
+    updated = await db.fiches.find_one({"id": fiche_id})
+    return FicheQSE(**updated)
+
+@api_router.delete("/fiches/{fiche_id}")
+async def delete_fiche(fiche_id: str):
+    fiche = await db.fiches.find_one_and_delete({"id": fiche_id})
+    if not fiche:
+        raise HTTPException(status_code=404, detail="Fiche non trouvée")
+    await adjust_stats(fiche, None)
+    # Lets devices drop the fiche on their next delta sync
+    await db.fiche_tombstones.update_one(
+        {"id": fiche_id}, {"$set": {"deleted_at": datetime.utcnow()}}, upsert=True
+    )
+    await delete_photo_blobs([photo["id"] for photo in fiche.get("photos", [])])
+    return {"message": "Fiche supprimée"}
+
+# ----- Photos -----
+
+# JPEG variants stored next to each original, as "<photo id>_<variant>"
+PHOTO_VARIANTS = ("thumbnail", "attachment")
+
+def photo_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name="photos")
+
+def process_photo(content: bytes) -> Dict[str, bytes]:
+    """Decode an image once and build its JPEG variants (blocking, runs in a worker).
+
+    Returns {} when the content is not a readable image. The attachment
+    variant is dropped when it would not be smaller than the original.
+    """
+    try:
+        image = Image.open(io.BytesIO(content))
+        # JPEG: let the decoder downscale directly to the largest size needed
+        image.draft("RGB", (PHOTO_ATTACHMENT_PX, PHOTO_ATTACHMENT_PX))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+    except (OSError, Image.DecompressionBombError):
+        # Not an image, truncated, or too large to decode safely
+        return {}
+    
+    variants = {}
+    for variant, max_px in (("attachment", PHOTO_ATTACHMENT_PX), ("thumbnail", PHOTO_THUMBNAIL_PX)):
+        image.thumbnail((max_px, max_px))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=PHOTO_JPEG_QUALITY, optimize=True)
+        variants[variant] = buffer.getvalue()
+    
+    if len(variants["attachment"]) >= len(content):
+        del variants["attachment"]
+    return variants
+
+async def upload_photo_blob(blob_id: str, filename: str, content: bytes, content_type: str) -> bool:
+    """Store a blob; False when one with this id exists already"""
+    try:
+        await photo_bucket().upload_from_stream_with_id(
+            blob_id, filename, content,
+            metadata={"content_type": content_type, "sha256": hashlib.sha256(content).hexdigest()}
+        )
+        return True
+    except FileExists:
+        # Already stored by an earlier attempt (retried sync or update, re-run migration)
+        return False
+
+async def check_stored_photo(photo_id: str, content: bytes):
+    """A reused photo id must carry the bytes already stored under it"""
+    stored = await db["photos.files"].find_one({"_id": photo_id}, {"length": 1, "metadata.sha256": 1})
+    if stored is None:
+        return
+    digest = (stored.get("metadata") or {}).get("sha256")
+    if digest is not None:
+        same = digest == hashlib.sha256(content).hexdigest()
+    else:
+        same = stored["length"] == len(content)  # Stored before digests were recorded
+    if not same:
+        raise HTTPException(status_code=409, detail=f"Identifiant de photo déjà utilisé pour une autre image: {photo_id}")
+
+async def save_photo(photo: Photo, content: bytes, store_original: bool = True) -> Photo:
+    """Store a photo's original bytes and its variants; returns the metadata-only photo"""
+    variants = await photo_pool.run(process_photo, content)
+    if store_original and not await upload_photo_blob(photo.id, photo.filename, content, photo.content_type):
+        await check_stored_photo(photo.id, content)
+    for variant, data in variants.items():
+        await upload_photo_blob(f"{photo.id}_{variant}", photo.filename, data, "image/jpeg")
+    return photo.model_copy(update={"data": None, "size": len(content), "variants": list(variants)})
+
+async def store_photos(photos: List[Photo]) -> List[Photo]:
+    """Move inline base64 photos into GridFS; the returned photos only carry metadata"""
+    stored = []
+    for photo in photos:
+        if photo.data is None:
+            stored.append(photo)
+        else:
+            stored.append(await save_photo(photo, base64.b64decode(photo.data)))
+    return stored
+
+async def load_photo_bytes(photo: Photo, variant: Optional[str] = None) -> bytes:
+    """Photo bytes, using the requested variant when it was generated"""
+    if photo.data is not None:
+        return base64.b64decode(photo.data)
+    blob_id = f"{photo.id}_{variant}" if variant and variant in (photo.variants or []) else photo.id
+    grid_out = await photo_bucket().open_download_stream(blob_id)
+    return await grid_out.read()
+
+async def delete_photo_blobs(photo_ids: List[str]):
+    """Delete the blobs of photos that no stored fiche references"""
+    if not photo_ids:
+        return
+    referenced = set(await db.fiches.distinct("photos.id", {"photos.id": {"$in": photo_ids}}))
+    for photo_id in photo_ids:
+        if photo_id in referenced:
+            continue
+        for blob_id in [photo_id] + [f"{photo_id}_{variant}" for variant in PHOTO_VARIANTS]:
+            try:
+                await photo_bucket().delete(blob_id)
+            except NoFile:
+                pass
+
+@api_router.post("/fiches/{fiche_id}/photos", response_model=Photo)
+async def upload_photo(fiche_id: str, file: UploadFile = File(...)):
+    fiche = await db.fiches.find_one({"id": fiche_id}, {"_id": 1})
+    if not fiche:
+        raise HTTPException(status_code=404, detail="Fiche non trouvée")
+    
+    content = await file.read()
+    photo = Photo(
+        filename=file.filename or f"photo_{int(time.time())}.jpg",
+        content_type=file.content_type or "image/jpeg"
+    )
+    photo = await save_photo(photo, content)
+    await db.fiches.update_one(
+        {"id": fiche_id},
+        {"$push": {"photos": photo.model_dump()}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+    return photo
+
+@api_router.get("/photos/{photo_id}")
+async def download_photo(photo_id: str, variant: Optional[str] = None):
+    """Original photo, or ?variant=thumbnail|attachment (falls back to the original)"""
+    if variant is not None and variant not in PHOTO_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Variante inconnue: {variant}")
+    
+    blob_ids = ([f"{photo_id}_{variant}"] if variant else []) + [photo_id]
+    grid_out = None
+    for blob_id in blob_ids:
+        try:
+            grid_out = await photo_bucket().open_download_stream(blob_id)
+            break
+        except NoFile:
+            continue
+    if grid_out is None:
+        raise HTTPException(status_code=404, detail="Photo non trouvée")
+    
+    async def chunks():
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            yield chunk
+    
+    metadata = grid_out.metadata or {}
+    return StreamingResponse(
+        chunks(),
+        media_type=metadata.get("content_type", "image/jpeg"),
+        headers={"Content-Length": str(grid_out.length), "Cache-Control": "private, max-age=86400"}
+    )
+
+@api_router.delete("/fiches/{fiche_id}/photos/{photo_id}")
+async def delete_photo(fiche_id: str, photo_id: str):
+    result = await db.fiches.update_one(
+        {"id": fiche_id, "photos.id": photo_id},
+        {"$pull": {"photos": {"id": photo_id}}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Photo non trouvée")
+    await delete_photo_blobs([photo_id])
+    return {"message": "Photo supprimée"}
+
+@api_router.post("/admin/migrate-photos")
+async def migrate_inline_photos():
+    """Move base64 photos still stored inside fiche documents into GridFS and
+    generate variants for stored photos that predate the image pipeline"""
+    migrated_fiches = 0
+    migrated_photos = 0
+    query = {"$or": [
+        {"photos.data": {"$type": "string"}},
+        {"photos": {"$elemMatch": {"variants": None}}}
+    ]}
+    cursor = db.fiches.find(query, {"id": 1, "photos": 1})
+    async for fiche in cursor:
+        photos = []
+        for photo in (Photo(**photo) for photo in fiche["photos"]):
+            if photo.data is not None:
+                photo = await save_photo(photo, base64.b64decode(photo.data))
+            elif photo.variants is None:
+                photo = await save_photo(photo, await load_photo_bytes(photo), store_original=False)
+            else:
+                photos.append(photo)
+                continue
+            photos.append(photo)
+            migrated_photos += 1
+        await db.fiches.update_one(
+            {"id": fiche["id"]},
+            {"$set": {"photos": [photo.model_dump() for photo in photos]}}
+        )
+        migrated_fiches += 1
+    
+    return {"fiches": migrated_fiches, "photos": migrated_photos}
+
+@api_router.get("/admin/photo-pool")
+async def get_photo_pool_stats():
+    return photo_pool.stats()
+
+# ----- Validate and Generate Excel -----
+
+@api_router.post("/fiches/{fiche_id}/validate")
 async def validate_fiche(fiche_id: str):
     fiche = await db.fiches.find_one({"id": fiche_id})
     if not fiche:
@@ -409,229 +2270,82 @@ async def validate_fiche(fiche_id: str):
     
     # Generate Excel file
     try:
-        excel_filename = await generate_excel(fiche_obj)
+        await get_excel_content(fiche_obj)
+        excel_filename = excel_filename_for(fiche_obj)
         
         # Update fiche status
-        await db.fiches.update_one(
-            {"id": fiche_id},
-            {"$set": {
-                "statut": "Validé",
-                "excel_filename": excel_filename,
-                "updated_at": datetime.utcnow()
-            }}
-        )
+        await set_fiche_statut(fiche_id, "Validé", excel_filename=excel_filename)
         
         return {
             "message": "Fiche validée et Excel généré",
             "excel_filename": excel_filename,
             "statut": "Validé"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error generating Excel: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur génération Excel: {str(e)}")
 
-def safe_write_cell(ws, cell_coord: str, value):
-    """Safely write to a cell, handling merged cells"""
-    if value is None:
-        return
-    
-    # Find if cell is in a merged range
-    for merged_range in ws.merged_cells.ranges:
-        if cell_coord in merged_range:
-            # Get top-left cell of merged range
-            top_left = str(merged_range).split(':')[0]
-            ws[top_left] = value
-            return
-    
-    # Not merged, write directly
-    ws[cell_coord] = value
-
-async def generate_excel(fiche: FicheQSE) -> str:
-    """Generate Excel file from fiche data"""
-    
-    # Check if template exists
+def check_excel_template():
     if not EXCEL_TEMPLATE_PATH.exists():
         raise HTTPException(status_code=500, detail="Template Excel non trouvé")
-    
-    # Load template with macros
-    wb = load_workbook(EXCEL_TEMPLATE_PATH, keep_vba=True)
-    
-    # Get the correct sheet based on type
-    if fiche.type == "Qualité":
-        ws = wb["ENS Qualité"]
-    elif fiche.type == "Sécurité":
-        ws = wb["ENS Sécurité"]
-    else:
-        ws = wb["ENS Environnement Energie"]
-    
-    # Fill common data
-    date_str = fiche.date_evenement.strftime("%d/%m/%Y")
-    
-    if fiche.type == "Qualité":
-        # Quality sheet specific cells
-        safe_write_cell(ws, "E6", date_str)
-        safe_write_cell(ws, "G6", fiche.heure_evenement)
-        safe_write_cell(ws, "L6", fiche.constate_par)
-        safe_write_cell(ws, "E7", fiche.service_emetteur)
-        safe_write_cell(ws, "M7", fiche.service_concerne)
-        
-        # Identification
-        safe_write_cell(ws, "G9", fiche.non_conformite_constatee)
-        safe_write_cell(ws, "G10", fiche.defaut)
-        safe_write_cell(ws, "G11", fiche.ccp_prpo)
-        safe_write_cell(ws, "G12", fiche.categorie_corps_etranger)
-        safe_write_cell(ws, "G13", fiche.quantite_concernee)
-        
-        # Traceability
-        safe_write_cell(ws, "G14", fiche.produit)
-        safe_write_cell(ws, "L14", fiche.numero_lot)
-        safe_write_cell(ws, "G15", fiche.grammage)
-        safe_write_cell(ws, "L15", fiche.numero_palette)
-        safe_write_cell(ws, "G16", fiche.marque)
-        safe_write_cell(ws, "L16", fiche.code_sca)
-        safe_write_cell(ws, "G17", fiche.ligne)
-        safe_write_cell(ws, "L17", fiche.reference_interne)
-        safe_write_cell(ws, "G18", fiche.ddm)
-        safe_write_cell(ws, "L18", fiche.date_production)
-        safe_write_cell(ws, "G19", fiche.quantieme)
-        safe_write_cell(ws, "L19", fiche.numero_bobine)
-        safe_write_cell(ws, "G20", fiche.heure_production)
-        safe_write_cell(ws, "L20", fiche.autres_tracabilite)
-        
-        # Description
-        safe_write_cell(ws, "D22", fiche.description)
-        
-        # Criticality
-        if fiche.criticite == "Mineure":
-            safe_write_cell(ws, "H30", "X")
-        elif fiche.criticite == "Majeure":
-            safe_write_cell(ws, "L30", "X")
-        elif fiche.criticite == "Critique":
-            safe_write_cell(ws, "N30", "X")
-        
-        safe_write_cell(ws, "N31", fiche.impact_securite_aliments)
-        
-        # Treatment
-        if fiche.traitement_blocage:
-            safe_write_cell(ws, "E35", "X")
-        if fiche.traitement_methanisation:
-            safe_write_cell(ws, "J35", "X")
-        if fiche.traitement_fonte:
-            safe_write_cell(ws, "E37", "X")
-        if fiche.traitement_analyses:
-            safe_write_cell(ws, "J37", "X")
-        if fiche.traitement_alimentation_animale:
-            safe_write_cell(ws, "E39", "X")
-        if fiche.traitement_autres:
-            safe_write_cell(ws, "J39", fiche.traitement_autres)
-        
-        safe_write_cell(ws, "E41", fiche.date_traitement)
-        safe_write_cell(ws, "L41", fiche.nom_traitement)
-        
-        # Causes (5M)
-        safe_write_cell(ws, "G43", fiche.cause_main_oeuvre)
-        safe_write_cell(ws, "G44", fiche.cause_materiel)
-        safe_write_cell(ws, "G45", fiche.cause_methode)
-        safe_write_cell(ws, "G46", fiche.cause_milieu)
-        safe_write_cell(ws, "G47", fiche.cause_matiere)
-        
-        # Corrective actions
-        for i, action in enumerate(fiche.actions_correctives[:5]):
-            row = 51 + i
-            safe_write_cell(ws, f"E{row}", action.action)
-            safe_write_cell(ws, f"J{row}", action.responsable)
-            safe_write_cell(ws, f"L{row}", action.delai)
-            safe_write_cell(ws, f"N{row}", action.statut)
-    
-    elif fiche.type == "Sécurité":
-        # Safety sheet
-        safe_write_cell(ws, "E6", date_str)
-        safe_write_cell(ws, "L6", fiche.constate_par)
-        safe_write_cell(ws, "E7", fiche.service_emetteur)
-        
-        # Type d'incident (checkboxes)
-        if fiche.type_incident == "Presqu'accident":
-            safe_write_cell(ws, "E9", "X")
-        elif fiche.type_incident == "Risques psychosociaux":
-            safe_write_cell(ws, "N9", "X")
-        elif fiche.type_incident == "Situation dangereuse":
-            safe_write_cell(ws, "E12", "X")
-        elif fiche.type_incident == "Acte dangereux":
-            safe_write_cell(ws, "E14", "X")
-        elif fiche.type_incident == "Impact environnemental":
-            safe_write_cell(ws, "N15", "X")
-        
-        # Description
-        safe_write_cell(ws, "D17", fiche.description)
-        
-        # Règle d'or
-        safe_write_cell(ws, "G24", fiche.regle_or)
-        
-        # Causes
-        causes_text = f"Main d'œuvre: {fiche.cause_main_oeuvre or ''}\nMatériel: {fiche.cause_materiel or ''}\nMéthode: {fiche.cause_methode or ''}\nMilieu: {fiche.cause_milieu or ''}"
-        safe_write_cell(ws, "D26", causes_text)
-        
-        # Actions
-        for i, action in enumerate(fiche.actions_correctives[:3]):
-            if i == 0:
-                safe_write_cell(ws, "E31", action.action)
-            else:
-                safe_write_cell(ws, "E32", action.action)
-            safe_write_cell(ws, f"J{31+i}", action.responsable)
-            safe_write_cell(ws, f"L{31+i}", action.delai)
-        
-        # Redaction date
-        safe_write_cell(ws, "E35", date_str)
-        safe_write_cell(ws, "L35", fiche.constate_par)
-    
-    else:  # Environment
-        safe_write_cell(ws, "E6", date_str)
-        safe_write_cell(ws, "L6", fiche.constate_par)
-        safe_write_cell(ws, "E7", fiche.service_emetteur)
-        
-        # Type environnement
-        if fiche.type_env and "Eaux" in fiche.type_env:
-            safe_write_cell(ws, "E10", "X")
-        if fiche.type_env and "Air" in fiche.type_env:
-            safe_write_cell(ws, "E13", "X")
-        if fiche.type_env and "Sol" in fiche.type_env:
-            safe_write_cell(ws, "E15", "X")
-        if fiche.type_env and "Déchets" in fiche.type_env:
-            safe_write_cell(ws, "N10", "X")
-        
-        # Description
-        safe_write_cell(ws, "D18", fiche.description)
-        
-        # Criticality
-        if fiche.criticite == "Mineure":
-            safe_write_cell(ws, "H26", "X")
-        elif fiche.criticite == "Majeure":
-            safe_write_cell(ws, "L26", "X")
-        elif fiche.criticite == "Critique":
-            safe_write_cell(ws, "N26", "X")
-        
-        # Causes
-        safe_write_cell(ws, "G35", fiche.cause_main_oeuvre)
-        safe_write_cell(ws, "G36", fiche.cause_materiel)
-        safe_write_cell(ws, "G37", fiche.cause_methode)
-        safe_write_cell(ws, "G38", fiche.cause_milieu)
-        safe_write_cell(ws, "G39", fiche.cause_matiere)
-        
-        # Redaction
-        safe_write_cell(ws, "E46", date_str)
-        safe_write_cell(ws, "L46", fiche.constate_par)
-    
-    # Generate filename
+
+def excel_filename_for(fiche: FicheQSE) -> str:
     service_clean = fiche.service_emetteur.replace(" ", "_").replace("/", "-")
     date_file = fiche.date_evenement.strftime("%Y%m%d")
     heure_file = fiche.heure_evenement.replace(":", "")
-    filename = f"NC_{service_clean}_{date_file}_{heure_file}.xlsm"
+    return f"NC_{service_clean}_{date_file}_{heure_file}.xlsm"
+
+def render_excel_content(fiche: FicheQSE) -> bytes:
+    """Fill the template for a fiche and return the .xlsm bytes (blocking, runs in a worker)"""
     
-    filepath = GENERATED_FILES_PATH / filename
-    wb.save(filepath)
-    wb.close()
+    # Copy of the cached template (macros included)
+    wb, layouts = excel_template_cache.get_workbook()
+    fill_workbook(wb, fiche, layouts)
     
-    return filename
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    wb.close()
+    return buffer.getvalue()
+
+async def get_excel_content(fiche: FicheQSE, export: bool = False) -> bytes:
+    """Workbook bytes for a fiche, reused from the report cache when its content is unchanged.
+
+    Exports wait for a render slot rather than failing mid-stream, and leave the cache as
+    they found it so that one large export does not evict the reports in daily use.
+    """
+    check_excel_template()
+    return await excel_report_cache.get_or_render(
+        await asyncio.to_thread(excel_report_key, fiche),
+        lambda: excel_render_pool.run(render_excel_content, fiche, wait=export),
+        keep=not export
+    )
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def fill_workbook(wb, fiche: FicheQSE, layouts: Dict[str, CompiledSheetLayout]):
+    """Write the fiche data into the matching ENS sheet"""
+    layout = layouts.get(fiche.type) or layouts[EXCEL_DEFAULT_LAYOUT]
+    ws = wb[layout.sheet]
+    layout.fill(ws, fiche)
+    return ws
+
+@api_router.get("/excel/template-cache")
+async def get_excel_template_cache_stats():
+    return excel_template_cache.stats()
+
+@api_router.get("/excel/render-pool")
+async def get_excel_render_pool_stats():
+    return excel_render_pool.stats()
+
+@api_router.get("/excel/report-cache")
+async def get_excel_report_cache_stats():
+    return excel_report_cache.stats()
 
 # ----- Download Excel -----
 
@@ -644,20 +2358,333 @@ async def download_excel(fiche_id: str):
     if not fiche.get("excel_filename"):
         raise HTTPException(status_code=400, detail="Excel non encore généré")
     
-    filepath = GENERATED_FILES_PATH / fiche["excel_filename"]
-    if not filepath.exists():
-        raise HTTPException(status_code=404, detail="Fichier Excel non trouvé")
-    
-    return FileResponse(
-        path=str(filepath),
-        filename=fiche["excel_filename"],
-        media_type="application/vnd.ms-excel.sheet.macroEnabled.12"
+    content = await get_excel_content(FicheQSE(**fiche))
+    return Response(
+        content=content,
+        media_type=EXCEL_MEDIA_TYPE,
+        headers={"Content-Disposition": content_disposition(fiche["excel_filename"])}
     )
 
 # ----- Send Email -----
 
+def email_recipients(config: EmailConfig, fiche: FicheQSE) -> List[str]:
+    recipients = list(config.default_recipients)
+    recipients.extend(config.auto_recipients_by_service.get(fiche.service_emetteur, []))
+    return list(set(recipients))  # Remove duplicates
+
+async def build_fiche_email(fiche_obj: FicheQSE, config: EmailConfig, recipients: List[str]) -> MIMEMultipart:
+    """Declaration e-mail with the Excel report and the photos attached"""
+    msg = MIMEMultipart()
+    date_str = fiche_obj.date_evenement.strftime("%d/%m/%Y")
+    
+    msg["Subject"] = f"Déclaration non-conformité – {fiche_obj.service_emetteur} – {date_str} {fiche_obj.heure_evenement}"
+    msg["From"] = config.smtp_user
+    msg["To"] = ", ".join(recipients)
+    
+    # Email body
+    body = f"""
+Bonjour,
+
+Une nouvelle fiche de non-conformité a été déclarée :
+
+Type : {fiche_obj.type}
+Date : {date_str}
+Heure : {fiche_obj.heure_evenement}
+Service : {fiche_obj.service_emetteur}
+Constaté par : {fiche_obj.constate_par}
+Criticité : {fiche_obj.criticite}
+
+Description :
+{fiche_obj.description}
+
+Le fichier Excel est joint à ce mail.
+
+Cordialement,
+Application QSE Mobile
+    """
+    msg.attach(MIMEText(body, "plain"))
+    
+    # Attach Excel file
+    if fiche_obj.excel_filename:
+        part = MIMEBase("application", "vnd.ms-excel.sheet.macroEnabled.12")
+        part.set_payload(await get_excel_content(fiche_obj))
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", f"attachment; filename={fiche_obj.excel_filename}")
+        msg.attach(part)
+    
+    # Attach photos
+    for i, photo in enumerate(fiche_obj.photos):
+        photo_data = await load_photo_bytes(photo, "attachment")
+        part = MIMEBase("image", "jpeg")
+        part.set_payload(photo_data)
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", f"attachment; filename=photo_{i+1}.jpg")
+        msg.attach(part)
+    
+    return msg
+
+def digest_table_rows(fiches: List[FicheQSE]) -> List[List[str]]:
+    return [
+        [
+            fiche.date_evenement.strftime("%d/%m/%Y"), fiche.heure_evenement, fiche.type,
+            fiche.service_emetteur, fiche.criticite, fiche.description.replace("\n", " ")[:80],
+        ]
+        for fiche in fiches
+    ]
+
+DIGEST_TABLE_HEADERS = ["Date", "Heure", "Type", "Service", "Criticité", "Description"]
+
+async def build_digest_email(fiches: List[FicheQSE], config: EmailConfig, recipients: List[str]) -> MIMEMultipart:
+    """Digest e-mail: one summary table and one workbook listing every fiche"""
+    msg = MIMEMultipart()
+    msg["Subject"] = f"Récapitulatif non-conformités – {len(fiches)} fiche(s) – {datetime.utcnow().strftime('%d/%m/%Y %H:%M')}"
+    msg["From"] = config.smtp_user
+    msg["To"] = ", ".join(recipients)
+    
+    rows = digest_table_rows(fiches)
+    text_table = "\n".join(" | ".join(row) for row in [DIGEST_TABLE_HEADERS] + rows)
+    html_rows = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(value)}</td>" for value in row) + "</tr>" for row in rows
+    )
+    html_headers = "".join(f"<th>{header}</th>" for header in DIGEST_TABLE_HEADERS)
+    
+    body = MIMEMultipart("alternative")
+    body.attach(MIMEText(
+        f"Bonjour,\n\n{len(fiches)} fiche(s) de non-conformité ont été déclarées :\n\n{text_table}\n\n"
+        "Le détail des fiches est joint à ce mail.\n\nCordialement,\nApplication QSE Mobile\n",
+        "plain"
+    ))
+    body.attach(MIMEText(
+        f"<p>Bonjour,</p><p>{len(fiches)} fiche(s) de non-conformité ont été déclarées :</p>"
+        f"<table border=\"1\" cellpadding=\"4\" cellspacing=\"0\"><tr>{html_headers}</tr>{html_rows}</table>"
+        "<p>Le détail des fiches est joint à ce mail.</p><p>Cordialement,<br>Application QSE Mobile</p>",
+        "html"
+    ))
+    msg.attach(body)
+    
+    # One summary workbook instead of a report and photos per fiche
+    workbook = b"".join([chunk async for chunk in stream_fiches_summary({"id": {"$in": [fiche.id for fiche in fiches]}})])
+    part = MIMEBase("application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    part.set_payload(workbook)
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", f"attachment; filename=recapitulatif_QSE_{datetime.utcnow().strftime('%Y%m%d_%H%M')}.xlsx")
+    msg.attach(part)
+    
+    return msg
+
+async def enqueue_digest_items(fiche_id: str, recipients: List[str], window_minutes: int) -> datetime:
+    """Queue a fiche for the digest of each recipient; returns when the first of those digests is due"""
+    now = datetime.utcnow()
+    for recipient in recipients:
+        try:
+            await db.email_digest_queue.update_one(
+                {"recipient": recipient, "fiche_id": fiche_id, "digest_id": None},
+                {"$setOnInsert": {"queued_at": now, "due_at": now + timedelta(minutes=window_minutes)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass  # Queued by a concurrent send
+    due = await db.email_digest_queue.aggregate([
+        {"$match": {"recipient": {"$in": recipients}, "digest_id": None}},
+        {"$group": {"_id": None, "due_at": {"$min": "$due_at"}}},
+    ]).to_list(1)
+    return due[0]["due_at"] if due else now
+
+async def flush_digest(recipient: str, digest_id: str):
+    """Turn the queue items claimed under digest_id into one outbox e-mail"""
+    items = await db.email_digest_queue.find({"digest_id": digest_id}, {"_id": 0, "fiche_id": 1}).to_list(None)
+    if items:
+        entry = OutboxEmail(
+            id=digest_id, kind="digest", recipients=[recipient],
+            fiche_ids=list(dict.fromkeys(item["fiche_id"] for item in items))
+        ).model_dump()
+        # Upsert so that finishing a flush interrupted by a crash does not queue the digest twice
+        await db.email_outbox.update_one({"id": digest_id}, {"$setOnInsert": entry}, upsert=True)
+        email_outbox_wakeup.set()
+    await db.email_digest_queue.delete_many({"digest_id": digest_id})
+
+async def flush_due_digests(force: bool = False) -> int:
+    """Queue the digests whose window has ended (all of them when forced); returns how many"""
+    now = datetime.utcnow()
+    pipeline = [
+        {"$match": {"digest_id": None}},
+        {"$group": {"_id": "$recipient", "due_at": {"$min": "$due_at"}}},
+    ]
+    if not force:
+        pipeline.append({"$match": {"due_at": {"$lte": now}}})
+    
+    flushed = 0
+    for group in await db.email_digest_queue.aggregate(pipeline).to_list(None):
+        digest_id = str(uuid.uuid4())
+        # Claim first so that a concurrent flush in another process skips these items
+        await db.email_digest_queue.update_many(
+            {"recipient": group["_id"], "digest_id": None},
+            {"$set": {"digest_id": digest_id, "claimed_at": now}}
+        )
+        await flush_digest(group["_id"], digest_id)
+        flushed += 1
+    
+    # Claims left behind by a process that stopped mid-flush
+    stale = await db.email_digest_queue.aggregate([
+        {"$match": {"digest_id": {"$ne": None}, "claimed_at": {"$lt": now - timedelta(minutes=5)}}},
+        {"$group": {"_id": "$digest_id", "recipient": {"$first": "$recipient"}}},
+    ]).to_list(None)
+    for claim in stale:
+        await flush_digest(claim["recipient"], claim["_id"])
+    return flushed
+
+async def email_digest_scheduler():
+    while True:
+        await asyncio.sleep(EMAIL_DIGEST_CHECK_SECONDS)
+        try:
+            flushed = await flush_due_digests()
+            if flushed:
+                logging.info(f"{flushed} digest e-mail(s) queued")
+        except PyMongoError as e:
+            logging.error(f"Digest flush failed: {e}")
+
+# Signalled when an e-mail is queued so idle outbox workers pick it up without waiting for the poll
+email_outbox_wakeup = asyncio.Event()
+email_outbox_tasks: List[asyncio.Task] = []
+
+def outbox_fiche_ids(entry: Dict[str, Any]) -> List[str]:
+    return entry.get("fiche_ids") or [entry["fiche_id"]]
+
+def email_retry_delay(attempts: int) -> float:
+    """Exponential backoff with +/-20% jitter so retries of a broken server spread out"""
+    delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+async def enqueue_fiche_email(fiche_id: str, recipients: List[str]) -> Dict[str, Any]:
+    """Queue a fiche e-mail, reusing the entry already waiting for this fiche if any.
+    Upserted on the fiche_active_unique index, so concurrent sends queue a single entry."""
+    active = {"kind": "fiche", "fiche_id": fiche_id, "status": {"$in": ["pending", "sending"]}}
+    while True:
+        entry = OutboxEmail(fiche_id=fiche_id, recipients=recipients).model_dump()
+        try:
+            result = await db.email_outbox.update_one(active, {"$setOnInsert": entry}, upsert=True)
+        except DuplicateKeyError:
+            result = None  # Inserted by a concurrent send
+        if result is not None and result.upserted_id is not None:
+            email_outbox_wakeup.set()
+            return entry
+        queued = await db.email_outbox.find_one(active, {"_id": 0})
+        if queued:
+            return queued
+        # Delivered in between: queue a new one
+
+async def renew_outbox_lease(entry: Dict[str, Any]) -> bool:
+    """Extend the lease of a claimed e-mail; False when its lease ended and another worker took it back"""
+    locked_until = datetime.utcnow() + timedelta(seconds=EMAIL_SEND_TIMEOUT * 2)
+    result = await db.email_outbox.update_one(
+        {"id": entry["id"], "status": "sending", "attempts": entry["attempts"]},
+        {"$set": {"locked_until": locked_until}}
+    )
+    return result.modified_count == 1
+
+async def claim_outbox_email() -> Optional[Dict[str, Any]]:
+    """Lease the next due e-mail; entries left "sending" by a crashed worker are taken back once their lease ends"""
+    now = datetime.utcnow()
+    return await db.email_outbox.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "locked_until": {"$lt": now}},
+        ]},
+        {
+            "$set": {"status": "sending", "locked_until": now + timedelta(seconds=EMAIL_SEND_TIMEOUT * 2), "updated_at": now},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("next_attempt_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def finish_outbox_email(entry: Dict[str, Any], error: Optional[str] = None):
+    """Record a delivery outcome on the outbox entry and the statut of its fiches"""
+    now = datetime.utcnow()
+    label = f"Digest {entry['id']}" if entry.get("kind") == "digest" else f"Email for fiche {entry['fiche_id']}"
+    if error is None:
+        await db.email_outbox.update_one(
+            {"id": entry["id"]},
+            {"$set": {"status": "sent", "sent_at": now, "updated_at": now, "last_error": None, "locked_until": None}}
+        )
+        for fiche_id in outbox_fiche_ids(entry):
+            await set_fiche_statut(fiche_id, "Envoyé")
+        logging.info(f"{label} sent (attempt {entry['attempts']})")
+    elif entry["attempts"] < EMAIL_MAX_ATTEMPTS:
+        retry_at = now + timedelta(seconds=email_retry_delay(entry["attempts"]))
+        await db.email_outbox.update_one(
+            {"id": entry["id"]},
+            {"$set": {"status": "pending", "next_attempt_at": retry_at, "updated_at": now, "last_error": error, "locked_until": None}}
+        )
+        logging.warning(f"{label} failed (attempt {entry['attempts']}), retry at {retry_at}: {error}")
+    else:
+        await db.email_outbox.update_one(
+            {"id": entry["id"]},
+            {"$set": {"status": "failed", "updated_at": now, "last_error": error, "locked_until": None}}
+        )
+        for fiche_id in outbox_fiche_ids(entry):
+            await set_fiche_statut(fiche_id, "Échec d'envoi")
+        logging.error(f"{label} abandoned after {entry['attempts']} attempts: {error}")
+
+async def deliver_outbox_email(entry: Dict[str, Any]):
+    projection = {"photos": 0, "signature": 0} if entry.get("kind") == "digest" else None
+    fiches = await db.fiches.find({"id": {"$in": outbox_fiche_ids(entry)}}, projection).sort("created_at", ASCENDING).to_list(None)
+    if not fiches:
+        await db.email_outbox.update_one(
+            {"id": entry["id"]},
+            {"$set": {"status": "failed", "updated_at": datetime.utcnow(), "last_error": "Fiche supprimée", "locked_until": None}}
+        )
+        return
+    _, email_config = await email_config_cache.get()
+    if not email_config or not email_config.get("smtp_user"):
+        await finish_outbox_email(entry, "Configuration email non définie")
+        return
+    
+    config = EmailConfig(**email_config)
+    try:
+        if entry.get("kind") == "digest":
+            msg = await build_digest_email([FicheQSE(**fiche) for fiche in fiches], config, entry["recipients"])
+        else:
+            msg = await build_fiche_email(FicheQSE(**fiches[0]), config, entry["recipients"])
+    except Exception as e:
+        await finish_outbox_email(entry, str(e) or type(e).__name__)
+        return
+    
+    # Rendering reports and loading photos may outlast the lease: renew it so that the
+    # send gets its full timeout, and do not send if another worker already took it back
+    if not await renew_outbox_lease(entry):
+        logging.warning(f"Outbox entry {entry['id']} lease lost while building the message, not sent")
+        return
+    try:
+        async with smtp_pool.connection(config) as smtp:
+            await smtp.send_message(msg)
+    except Exception as e:
+        await finish_outbox_email(entry, str(e) or type(e).__name__)
+        return
+    await finish_outbox_email(entry)
+
+async def email_outbox_worker():
+    while True:
+        try:
+            email_outbox_wakeup.clear()
+            entry = await claim_outbox_email()
+            if entry is None:
+                await smtp_pool.close_idle()
+                try:
+                    await asyncio.wait_for(email_outbox_wakeup.wait(), EMAIL_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await deliver_outbox_email(entry)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Email outbox worker error: {e}")
+            await asyncio.sleep(EMAIL_POLL_SECONDS)
+
 @api_router.post("/fiches/{fiche_id}/send-email")
 async def send_fiche_email(fiche_id: str):
+    """Queue the fiche e-mail; outbox workers deliver it and set the statut to Envoyé or Échec d'envoi"""
     fiche = await db.fiches.find_one({"id": fiche_id})
     if not fiche:
         raise HTTPException(status_code=404, detail="Fiche non trouvée")
@@ -665,13 +2692,10 @@ async def send_fiche_email(fiche_id: str):
     fiche_obj = FicheQSE(**fiche)
     
     # Get email config
-    email_config = await db.email_config.find_one()
+    _, email_config = await email_config_cache.get()
     if not email_config or not email_config.get("smtp_user"):
         # Update status to "Validé" (email not configured)
-        await db.fiches.update_one(
-            {"id": fiche_id},
-            {"$set": {"statut": "Validé", "updated_at": datetime.utcnow()}}
-        )
+        await set_fiche_statut(fiche_id, "Validé")
         return {
             "message": "Configuration email non définie. Fiche validée mais email non envoyé.",
             "statut": "Validé"
@@ -680,118 +2704,261 @@ async def send_fiche_email(fiche_id: str):
     config = EmailConfig(**email_config)
     
     # Get recipients
-    recipients = list(config.default_recipients)
-    service_recipients = config.auto_recipients_by_service.get(fiche_obj.service_emetteur, [])
-    recipients.extend(service_recipients)
-    recipients = list(set(recipients))  # Remove duplicates
+    recipients = email_recipients(config, fiche_obj)
     
     if not recipients:
-        await db.fiches.update_one(
-            {"id": fiche_id},
-            {"$set": {"statut": "Validé", "updated_at": datetime.utcnow()}}
-        )
+        await set_fiche_statut(fiche_id, "Validé")
         return {"message": "Aucun destinataire configuré", "statut": "Validé"}
     
-    try:
-        # Create email
-        msg = MIMEMultipart()
-        date_str = fiche_obj.date_evenement.strftime("%d/%m/%Y")
-        
-        msg["Subject"] = f"Déclaration non-conformité – {fiche_obj.service_emetteur} – {date_str} {fiche_obj.heure_evenement}"
-        msg["From"] = config.smtp_user
-        msg["To"] = ", ".join(recipients)
-        
-        # Email body
-        body = f"""
-Bonjour,
+    # Set before queueing: a worker may deliver right away and set Envoyé
+    await set_fiche_statut(fiche_id, "Validé")
+    if config.digest_enabled and fiche_obj.criticite not in config.digest_immediate_criticites:
+        due_at = await enqueue_digest_items(fiche_id, recipients, config.digest_window_minutes)
+        return {"message": "Fiche ajoutée au prochain récapitulatif email", "statut": "Validé", "digest_due_at": due_at}
+    
+    entry = await enqueue_fiche_email(fiche_id, recipients)
+    return {"message": "Email en cours d'envoi", "statut": "Validé", "outbox_id": entry["id"]}
 
-Une nouvelle fiche de non-conformité a été déclarée :
+@api_router.get("/email-digests")
+async def get_email_digests():
+    """Fiches waiting for a digest, per recipient"""
+    groups = await db.email_digest_queue.aggregate([
+        {"$match": {"digest_id": None}},
+        {"$group": {"_id": "$recipient", "fiches": {"$sum": 1}, "due_at": {"$min": "$due_at"}}},
+        {"$sort": {"due_at": 1}},
+    ]).to_list(None)
+    return [{"recipient": group["_id"], "fiches": group["fiches"], "due_at": group["due_at"]} for group in groups]
 
-Type : {fiche_obj.type}
-Date : {date_str}
-Heure : {fiche_obj.heure_evenement}
-Service : {fiche_obj.service_emetteur}
-Constaté par : {fiche_obj.constate_par}
-Criticité : {fiche_obj.criticite}
+@api_router.post("/email-digests/flush")
+async def flush_email_digests():
+    """Send every pending digest now, without waiting for the end of its window"""
+    return {"digests": await flush_due_digests(force=True)}
 
-Description :
-{fiche_obj.description}
+@api_router.get("/admin/smtp-pool")
+async def get_smtp_pool_stats():
+    return smtp_pool.stats()
 
-Le fichier Excel est joint à ce mail.
+@api_router.get("/email-outbox", response_model=List[OutboxEmail])
+async def get_email_outbox(status: Optional[str] = None, fiche_id: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    query = {}
+    if status:
+        query["status"] = status
+    if fiche_id:
+        query["$or"] = [{"fiche_id": fiche_id}, {"fiche_ids": fiche_id}]
+    entries = await db.email_outbox.find(query, {"_id": 0}).sort("created_at", DESCENDING).to_list(limit)
+    return [OutboxEmail(**entry) for entry in entries]
 
-Cordialement,
-Application QSE Mobile
-        """
-        msg.attach(MIMEText(body, "plain"))
-        
-        # Attach Excel file
-        if fiche_obj.excel_filename:
-            filepath = GENERATED_FILES_PATH / fiche_obj.excel_filename
-            if filepath.exists():
-                with open(filepath, "rb") as f:
-                    part = MIMEBase("application", "vnd.ms-excel.sheet.macroEnabled.12")
-                    part.set_payload(f.read())
-                    encoders.encode_base64(part)
-                    part.add_header("Content-Disposition", f"attachment; filename={fiche_obj.excel_filename}")
-                    msg.attach(part)
-        
-        # Attach photos
-        for i, photo in enumerate(fiche_obj.photos):
-            photo_data = base64.b64decode(photo.data)
-            part = MIMEBase("image", "jpeg")
-            part.set_payload(photo_data)
-            encoders.encode_base64(part)
-            part.add_header("Content-Disposition", f"attachment; filename=photo_{i+1}.jpg")
-            msg.attach(part)
-        
-        # Send email
-        await aiosmtplib.send(
-            msg,
-            hostname=config.smtp_server,
-            port=config.smtp_port,
-            username=config.smtp_user,
-            password=config.smtp_password,
-            use_tls=config.use_tls
-        )
-        
-        # Update status
-        await db.fiches.update_one(
-            {"id": fiche_id},
-            {"$set": {"statut": "Envoyé", "updated_at": datetime.utcnow()}}
-        )
-        
-        return {"message": "Email envoyé avec succès", "statut": "Envoyé"}
-        
-    except Exception as e:
-        logging.error(f"Error sending email: {e}")
-        await db.fiches.update_one(
-            {"id": fiche_id},
-            {"$set": {"statut": "Échec d'envoi", "updated_at": datetime.utcnow()}}
-        )
-        return {"message": f"Erreur envoi email: {str(e)}", "statut": "Échec d'envoi"}
+@api_router.post("/email-outbox/{outbox_id}/retry", response_model=OutboxEmail)
+async def retry_outbox_email(outbox_id: str):
+    entry = await db.email_outbox.find_one({"id": outbox_id}, {"_id": 0})
+    if not entry:
+        raise HTTPException(status_code=404, detail="Envoi non trouvé")
+    if entry["status"] != "failed":
+        raise HTTPException(status_code=409, detail="Seuls les envois en échec peuvent être relancés")
+    # Set before requeueing: a worker may deliver right away and set Envoyé
+    for fiche_id in outbox_fiche_ids(entry):
+        await set_fiche_statut(fiche_id, "Validé")
+    now = datetime.utcnow()
+    changes = {"status": "pending", "attempts": 0, "next_attempt_at": now, "updated_at": now}
+    try:
+        result = await db.email_outbox.update_one({"id": outbox_id, "status": "failed"}, {"$set": changes})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Un envoi de cette fiche est déjà en attente")
+    if not result.modified_count:
+        raise HTTPException(status_code=409, detail="Seuls les envois en échec peuvent être relancés")
+    entry.update(changes)
+    email_outbox_wakeup.set()
+    return OutboxEmail(**entry)
 
 # ----- Sync (for offline) -----
 
+async def find_ids_by_client_id(client_ids: List[str]) -> Dict[str, str]:
+    if not client_ids:
+        return {}
+    cursor = db.fiches.find({"client_id": {"$in": client_ids}}, {"_id": 0, "id": 1, "client_id": 1})
+    return {fiche["client_id"]: fiche["id"] async for fiche in cursor}
+
 @api_router.post("/sync")
-async def sync_fiches(fiches: List[FicheCreate]):
-    """Sync multiple fiches from offline storage"""
-    results = []
-    for fiche in fiches:
+async def sync_fiches(fiches: List[SyncFiche]):
+    """Sync offline fiches in one unordered bulk write. Fiches carrying a client_id are
+    upserted on it, so a retried sync reports the fiches stored by the first attempt."""
+    results: List[Dict[str, Any]] = [{"client_id": fiche.client_id} for fiche in fiches]
+    existing = await find_ids_by_client_id([fiche.client_id for fiche in fiches if fiche.client_id])
+
+    # Documents to write, with the position of their item in the request
+    pending: List[Tuple[int, Dict[str, Any]]] = []
+    first_index: Dict[str, int] = {}
+    for index, fiche in enumerate(fiches):
+        if fiche.client_id in existing:
+            results[index].update(id=existing[fiche.client_id], status="already_synced")
+            continue
+        if fiche.client_id in first_index:
+            continue  # Same fiche twice in one batch, answered like the first one below
         try:
-            fiche_dict = fiche.model_dump()
-            fiche_obj = FicheQSE(**fiche_dict)
-            await db.fiches.insert_one(fiche_obj.model_dump())
-            results.append({"id": fiche_obj.id, "status": "synced"})
+            fiche_obj = FicheQSE(**fiche.model_dump(), sync_status="synced")
         except Exception as e:
-            results.append({"status": "failed", "error": str(e)})
-    
+            results[index].update(status="failed", error=str(e))
+            continue
+        try:
+            fiche_obj.photos = await store_photos(fiche_obj.photos)
+        except Exception as e:
+            await delete_photo_blobs([photo.id for photo in fiche_obj.photos])
+            results[index].update(status="failed", error=str(e))
+            continue
+        if fiche.client_id:
+            first_index[fiche.client_id] = index
+        pending.append((index, fiche_obj.model_dump()))
+
+    outcome: Dict[str, Any] = {"writeErrors": [], "upserted": []}
+    if pending:
+        # Stamped right before the write, after every photo of the batch is stored (see create_fiche)
+        now = datetime.utcnow()
+        for _, doc in pending:
+            doc["created_at"] = doc["updated_at"] = now
+        operations = [
+            UpdateOne({"client_id": doc["client_id"]}, {"$setOnInsert": doc}, upsert=True)
+            if doc["client_id"] else InsertOne(doc)
+            for _, doc in pending
+        ]
+        try:
+            outcome = (await db.fiches.bulk_write(operations, ordered=False)).bulk_api_result
+        except BulkWriteError as e:
+            outcome = e.details
+    write_errors = {error["index"]: error for error in outcome.get("writeErrors", [])}
+    upserted = {upsert["index"] for upsert in outcome.get("upserted", [])}
+
+    inserted = []
+    raced = []
+    unused_photos = []  # Photos uploaded for documents that were not inserted
+    for position, (index, doc) in enumerate(pending):
+        error = write_errors.get(position)
+        if doc["client_id"] and position not in upserted and (not error or error.get("code") == 11000):
+            raced.append(index)  # Stored meanwhile by a concurrent sync of the same device
+            unused_photos.extend(photo["id"] for photo in doc["photos"])
+        elif error:
+            results[index].update(status="failed", error=error.get("errmsg", "Erreur d'écriture"))
+            unused_photos.extend(photo["id"] for photo in doc["photos"])
+        else:
+            inserted.append((None, doc))
+            results[index].update(id=doc["id"], status="synced")
+    await adjust_stats_many(inserted)
+
+    stored = await find_ids_by_client_id([results[index]["client_id"] for index in raced])
+    for index in raced:
+        results[index].update(id=stored.get(results[index]["client_id"]), status="already_synced")
+    # Blobs a stored fiche references (a retry of the same device reuses its photo ids) are kept
+    await delete_photo_blobs(unused_photos)
+
+    for index, fiche in enumerate(fiches):
+        if "status" not in results[index]:
+            results[index] = {**results[first_index[fiche.client_id]], "client_id": fiche.client_id}
+
     return {"results": results}
 
+# Position in a (timestamp, id) ordered stream of changes
+SyncPosition = Tuple[datetime, str]
+
+def encode_sync_token(synced_at: datetime, fiches_after: SyncPosition, deleted_after: SyncPosition) -> str:
+    payload = json.dumps({
+        "at": synced_at.isoformat(),
+        "fiches": [fiches_after[0].isoformat(), fiches_after[1]],
+        "deleted": [deleted_after[0].isoformat(), deleted_after[1]],
+    })
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_sync_token(token: str) -> Tuple[datetime, SyncPosition, SyncPosition]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        synced_at = datetime.fromisoformat(payload["at"])
+        fiches_after = (datetime.fromisoformat(payload["fiches"][0]), str(payload["fiches"][1]))
+        deleted_after = (datetime.fromisoformat(payload["deleted"][0]), str(payload["deleted"][1]))
+    except (ValueError, TypeError, KeyError, IndexError):
+        raise HTTPException(status_code=400, detail="Jeton de synchronisation invalide")
+    return synced_at, fiches_after, deleted_after
+
+def changed_after(field: str, position: SyncPosition, until: datetime) -> Dict[str, Any]:
+    """Keyset condition for the documents after `position` in (field, id) order, up to `until`"""
+    after, after_id = position
+    return {"$and": [
+        {field: {"$lte": until}},
+        {"$or": [{field: {"$gt": after}}, {field: after, "id": {"$gt": after_id}}]},
+    ]}
+
+@api_router.get("/sync/changes")
+async def get_sync_changes(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    view: str = "full"
+):
+    """Fiches created or updated, and ids of fiches deleted, since the `since` token.
+
+    Without `since` every fiche is returned. Pass `next_since` back as `since`, right
+    away while `has_more` is true, then on the next refresh.
+    """
+    if view not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="Vue inconnue (full ou summary)")
+
+    now = datetime.utcnow()
+    until = now - timedelta(seconds=SYNC_CHANGES_LAG_SECONDS)
+    if since:
+        synced_at, fiches_after, deleted_after = decode_sync_token(since)
+        if synced_at < now - timedelta(days=SYNC_TOMBSTONE_DAYS):
+            raise HTTPException(status_code=410, detail="Jeton de synchronisation expiré, resynchronisation complète requise")
+    else:
+        # A device without data has no deletions to apply
+        fiches_after, deleted_after = (datetime.min, ""), (until, "")
+
+    projection = {**FICHE_SUMMARY_PROJECTION, "updated_at": 1} if view == "summary" else None
+    fiches = await db.fiches.find(changed_after("updated_at", fiches_after, until), projection).sort(
+        [("updated_at", ASCENDING), ("id", ASCENDING)]
+    ).to_list(limit + 1)
+    tombstones = await db.fiche_tombstones.find(changed_after("deleted_at", deleted_after, until), {"_id": 0}).sort(
+        [("deleted_at", ASCENDING), ("id", ASCENDING)]
+    ).to_list(limit + 1)
+
+    # Resume after the last item returned, or at `until` once everything up to it was sent
+    has_more = False
+    if len(fiches) > limit:
+        fiches, has_more = fiches[:limit], True
+        fiches_after = (fiches[-1]["updated_at"], fiches[-1]["id"])
+    else:
+        fiches_after = (until, "")
+    if len(tombstones) > limit:
+        tombstones, has_more = tombstones[:limit], True
+        deleted_after = (tombstones[-1]["deleted_at"], tombstones[-1]["id"])
+    else:
+        deleted_after = (until, "")
+
+    model = FicheSummary if view == "summary" else FicheQSE
+    return {
+        "fiches": [model(**fiche) for fiche in fiches],
+        "deleted": [tombstone["id"] for tombstone in tombstones],
+        "has_more": has_more,
+        "next_since": encode_sync_token(now, fiches_after, deleted_after),
+    }
+
 # ----- Configuration -----
 
+# Without a stored config the defaults are served: their ETag follows DEFAULT_CONFIG, so a
+# release that changes the defaults invalidates what devices cached
+DEFAULT_CONFIG_ETAG = '"default-%s"' % hashlib.sha256(
+    json.dumps(DEFAULT_CONFIG, sort_keys=True, ensure_ascii=False).encode("utf-8")
+).hexdigest()[:16]
+
+def config_etag(stamp: Optional[Tuple[str, int]]) -> str:
+    return f'"{stamp[0]}-{stamp[1]}"' if stamp else DEFAULT_CONFIG_ETAG
+
 @api_router.get("/config")
-async def get_config():
-    config = await db.config.find_one()
+async def get_config(response: Response, if_none_match: Optional[str] = Header(None)):
+    """Configuration lists, with an ETag so unchanged configs are answered with 304"""
+    stamp, config = await config_cache.get()
+    etag = config_etag(stamp)
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
     if not config:
         # Return default config
         return DEFAULT_CONFIG
@@ -799,25 +2966,28 @@ async def get_config():
 
 @api_router.put("/config")
 async def update_config(config: ConfigData):
-    existing = await db.config.find_one()
+    config_dict = config.model_dump()
+    existing = await db.config.find_one({}, {"_id": 0, "id": 1})
     if existing:
-        await db.config.update_one({"id": existing["id"]}, {"$set": config.model_dump()})
+        config_dict["id"] = existing["id"]
+        await db.config.update_one({"id": existing["id"]}, {"$set": config_dict, "$inc": {"version": 1}})
     else:
-        await db.config.insert_one(config.model_dump())
-    return config
+        await db.config.insert_one({**config_dict, "version": 1})
+    config_cache.invalidate()
+    return ConfigData(**config_dict)
 
 @api_router.get("/email-config")
 async def get_email_config():
-    config = await db.email_config.find_one()
+    _, config = await email_config_cache.get()
     if not config:
         return EmailConfig().model_dump()
     # Don't return password
     config["smtp_password"] = "***" if config.get("smtp_password") else ""
-    return config
+    return EmailConfig(**config).model_dump()
 
 @api_router.put("/email-config")
 async def update_email_config(config: EmailConfig):
-    existing = await db.email_config.find_one()
+    existing = await db.email_config.find_one({}, {"_id": 0, "id": 1, "smtp_password": 1})
     config_dict = config.model_dump()
     
     # If password is masked, keep the old one
@@ -825,38 +2995,425 @@ async def update_email_config(config: EmailConfig):
         config_dict["smtp_password"] = existing.get("smtp_password", "")
     
     if existing:
-        await db.email_config.update_one({"id": existing["id"]}, {"$set": config_dict})
+        config_dict["id"] = existing["id"]
+        await db.email_config.update_one({"id": existing["id"]}, {"$set": config_dict, "$inc": {"version": 1}})
     else:
-        await db.email_config.insert_one(config_dict)
+        await db.email_config.insert_one({**config_dict, "version": 1})
+    email_config_cache.invalidate()
     
     return {"message": "Configuration email mise à jour"}
 
+@api_router.get("/admin/config-cache")
+async def get_config_cache_stats():
+    return {"config": config_cache.stats(), "email_config": email_config_cache.stats(), "users": user_cache.stats()}
+
 # ----- Stats -----
 
 @api_router.get("/stats")
 async def get_stats():
-    total = await db.fiches.count_documents({})
-    brouillon = await db.fiches.count_documents({"statut": "Brouillon"})
-    valide = await db.fiches.count_documents({"statut": "Validé"})
-    envoye = await db.fiches.count_documents({"statut": "Envoyé"})
-    echec = await db.fiches.count_documents({"statut": "Échec d'envoi"})
-    
-    by_type = {
-        "Qualité": await db.fiches.count_documents({"type": "Qualité"}),
-        "Sécurité": await db.fiches.count_documents({"type": "Sécurité"}),
-        "Environnement": await db.fiches.count_documents({"type": "Environnement"})
-    }
-    
-    return {
-        "total": total,
-        "by_status": {
-            "brouillon": brouillon,
-            "valide": valide,
-            "envoye": envoye,
-            "echec": echec
-        },
-        "by_type": by_type
+    return await read_stats()
+
+@api_router.post("/admin/stats/rebuild")
+async def rebuild_stats_counters():
+    await rebuild_stats()
+    return await read_stats()
+
+# ----- Analytics -----
+
+# Dimensions an analysis can group on, and the fiche field they read (list fields are unwound)
+ANALYTICS_DIMENSIONS = {
+    "type": "type",
+    "statut": "statut",
+    "service": "service_emetteur",
+    "service_concerne": "service_concerne",
+    "criticite": "criticite",
+    "non_conformite": "non_conformite_constatee",
+    "defaut": "defaut",
+    "ccp_prpo": "ccp_prpo",
+    "categorie_corps_etranger": "categorie_corps_etranger",
+    "produit": "produit",
+    "ligne": "ligne",
+    "type_incident": "type_incident",
+    "type_risque": "type_risque",
+    "regle_or": "regle_or",
+    "type_env": "type_env",
+    "traitement_env": "traitement_env",
+}
+ANALYTICS_LIST_FIELDS = {"traitement_env"}
+
+# Time buckets on date_evenement ($dateToString formats, weeks are ISO weeks)
+ANALYTICS_BUCKETS = {"day": "%Y-%m-%d", "week": "%G-W%V", "month": "%Y-%m", "year": "%Y"}
+
+class AnalyticsResultCache:
+    """Bounded LRU of analytics results keyed on (query, data version).
+
+    A write to the fiches changes the data version, so results computed before it
+    are simply never looked up again and age out of the LRU.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        result = self._entries.get(key)
+        if result is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: Tuple[str, str], result: Dict[str, Any]):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self._hits, "misses": self._misses}
+
+analytics_cache = AnalyticsResultCache(ANALYTICS_CACHE_SIZE)
+
+async def fiches_data_version() -> str:
+    """Changes whenever a fiche is created, updated or deleted: latest updated_at,
+    latest tombstone and document count, each read from an index or metadata"""
+    latest, deleted, count = await asyncio.gather(
+        db.fiches.find({}, {"_id": 0, "id": 1, "updated_at": 1}).sort(
+            [("updated_at", DESCENDING), ("id", DESCENDING)]
+        ).limit(1).to_list(1),
+        db.fiche_tombstones.find({}, {"_id": 0, "id": 1, "deleted_at": 1}).sort(
+            [("deleted_at", DESCENDING), ("id", DESCENDING)]
+        ).limit(1).to_list(1),
+        db.fiches.estimated_document_count(),
+    )
+    parts = [str(count)]
+    for docs, field in ((latest, "updated_at"), (deleted, "deleted_at")):
+        parts.append(f"{docs[0][field].isoformat()}/{docs[0]['id']}" if docs else "")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+def analytics_pipeline(match: Dict[str, Any], field: Optional[str], bucket: Optional[str]) -> List[Dict[str, Any]]:
+    """Count fiches per dimension value and/or time bucket"""
+    pipeline: List[Dict[str, Any]] = [{"$match": match}]
+    group_id: Dict[str, Any] = {}
+    if field:
+        if field in ANALYTICS_LIST_FIELDS:
+            pipeline.append({"$unwind": f"${field}"})
+        pipeline.append({"$match": {field: {"$nin": [None, ""]}}})
+        group_id["value"] = f"${field}"
+    if bucket:
+        group_id["period"] = {"$dateToString": {"format": ANALYTICS_BUCKETS[bucket], "date": "$date_evenement"}}
+    pipeline.append({"$group": {"_id": group_id or None, "count": {"$sum": 1}}})
+    return pipeline
+
+def percent(part: int, total: int) -> float:
+    return round(part * 100 / total, 1) if total else 0.0
+
+def pareto_rows(counts: Dict[str, int], top: Optional[int]) -> Dict[str, Any]:
+    """Values by decreasing count with their share and cumulative share of the total"""
+    total = sum(counts.values())
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    rows = []
+    cumulative = 0
+    for value, count in ranked[:top]:
+        cumulative += count
+        rows.append({"value": value, "count": count, "share": percent(count, total), "cumulative_share": percent(cumulative, total)})
+    return {"total": total, "rows": rows, "others": total - cumulative}
+
+def trend_rows(groups: List[Dict[str, Any]], by_value: bool, top: Optional[int]) -> Dict[str, Any]:
+    """Counts per period; with a dimension, split on its `top` values plus the others"""
+    totals: Dict[str, int] = {}
+    for group in groups:
+        totals[group["_id"]["period"]] = totals.get(group["_id"]["period"], 0) + group["count"]
+    result: Dict[str, Any] = {"total": sum(totals.values())}
+    if not by_value:
+        result["rows"] = [{"period": period, "count": count} for period, count in sorted(totals.items())]
+        return result
+
+    value_totals = Counter()
+    for group in groups:
+        value_totals[group["_id"]["value"]] += group["count"]
+    values = [value for value, _ in sorted(value_totals.items(), key=lambda item: (-item[1], item[0]))[:top]]
+    kept = set(values)
+    rows = {period: {"period": period, "count": count, "values": {}, "others": count} for period, count in totals.items()}
+    for group in groups:
+        if group["_id"]["value"] in kept:
+            row = rows[group["_id"]["period"]]
+            row["values"][group["_id"]["value"]] = group["count"]
+            row["others"] -= group["count"]
+    result["values"] = values
+    result["rows"] = [rows[period] for period in sorted(rows)]
+    return result
+
+@api_router.get("/analytics")
+async def get_analytics(
+    dimension: Optional[str] = None,
+    bucket: Optional[str] = None,
+    statut: Optional[str] = None,
+    type: Optional[str] = None,
+    service: Optional[str] = None,
+    criticite: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    top: Optional[int] = Query(None, ge=1, le=1000)
+):
+    """Counts computed in Mongo, e.g. dimension=defaut&type=Qualité for a Pareto of the
+    defects, or bucket=month&dimension=type_risque for a monthly trend per risk"""
+    field = ANALYTICS_DIMENSIONS.get(dimension) if dimension else None
+    if dimension and not field:
+        raise HTTPException(status_code=400, detail=f"Dimension inconnue: {dimension}")
+    if bucket and bucket not in ANALYTICS_BUCKETS:
+        raise HTTPException(status_code=400, detail="Période inconnue (day, week, month ou year)")
+    match = build_fiche_query(statut, type, service, date_from, date_to)
+    if criticite:
+        match["criticite"] = criticite
+
+    params = {"dimension": dimension, "bucket": bucket, "match": match, "top": top}
+    data_version = await fiches_data_version()
+    key = (json.dumps(params, sort_keys=True, default=str), data_version)
+    result = analytics_cache.get(key)
+    if result is None:
+        groups = await db.fiches.aggregate(analytics_pipeline(match, field, bucket)).to_list(None)
+        if bucket:
+            result = trend_rows(groups, bool(field), top)
+        elif field:
+            result = pareto_rows({group["_id"]["value"]: group["count"] for group in groups}, top)
+        else:
+            result = {"total": groups[0]["count"] if groups else 0}
+        result = {"dimension": dimension, "bucket": bucket, "data_version": data_version, **result}
+        analytics_cache.put(key, result)
+    return result
+
+@api_router.get("/admin/analytics-cache")
+async def get_analytics_cache_stats():
+    return analytics_cache.stats()
+
+# ----- Analytics Snapshot -----
+
+# Partition columns, encoded in the directory names (month=YYYY-MM/type=...)
+SNAPSHOT_PARTITION_FIELDS = ["month", "type"]
+
+def snapshot_arrow_type(annotation):
+    """Arrow type of a model field annotation, Optional unwrapped"""
+    if get_origin(annotation) is Union:
+        annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+    if get_origin(annotation) in (list, List):
+        return pa.list_(pa.string())
+    return {datetime: pa.timestamp("us"), bool: pa.bool_(), int: pa.int64()}.get(annotation, pa.string())
+
+def snapshot_file_schema():
+    """Schema of the Parquet files: the export row without the partition columns"""
+    fields = [
+        pa.field(field, snapshot_arrow_type(FicheQSE.model_fields[field].annotation))
+        for field in EXPORT_ROW_FIELDS if field not in SNAPSHOT_PARTITION_FIELDS
+    ]
+    fields.append(pa.field("nb_actions", pa.int64()))
+    fields.extend(pa.field(column, pa.string()) for column in EXPORT_ROW_COLUMNS if column.startswith("action_"))
+    return pa.schema(fields)
+
+def month_bounds(month: str) -> Tuple[datetime, datetime]:
+    start = datetime.strptime(month, "%Y-%m")
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+class AnalyticsSnapshot:
+    """Parquet copy of the fiches, partitioned by event month and type, for analytics.
+
+    Each refresh rebuilds only the partitions touched since the previous one: those of
+    fiches updated after the watermark (before and after the change) and of tombstones.
+    `_state.json` keeps the watermark and which partition holds each fiche.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = asyncio.Lock()
+
+    @property
+    def state_path(self) -> Path:
+        return self.path / "_state.json"
+
+    def load_state(self) -> Dict[str, Any]:
+        if not self.state_path.exists():
+            return {"watermark": None, "partitions": {}}
+        return json.loads(self.state_path.read_text())
+
+    def _save_state(self, state: Dict[str, Any]):
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state))
+        os.replace(tmp, self.state_path)
+
+    def _partition_dir(self, month: str, fiche_type: str) -> Path:
+        return self.path / f"month={month}" / f"type={quote(fiche_type, safe='')}"
+
+    def _write_partition(self, month: str, fiche_type: str, rows: List[Dict[str, Any]]):
+        directory = self._partition_dir(month, fiche_type)
+        if not rows:
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        table = pa.Table.from_pylist(rows, schema=snapshot_file_schema())
+        tmp = directory / "data.parquet.tmp"
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, directory / "data.parquet")
+
+    async def refresh(self) -> Dict[str, Any]:
+        self.path.mkdir(parents=True, exist_ok=True)
+        async with self._lock:
+            with open(self.path / "_lock", "w") as lock_file:
+                try:
+                    # Another worker process sharing the directory is already refreshing it
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return {"skipped": True}
+                return await self._refresh()
+
+    async def _refresh(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        state = await asyncio.to_thread(self.load_state)
+        index: Dict[str, str] = state["partitions"]  # fiche id -> "month|type"
+        until = datetime.utcnow() - timedelta(seconds=SYNC_CHANGES_LAG_SECONDS)
+        
+        affected = set()
+        if state["watermark"] is None:
+            groups = await db.fiches.aggregate([{"$group": {"_id": {
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$date_evenement"}},
+                "type": "$type",
+            }}}]).to_list(None)
+            affected = {f"{group['_id']['month']}|{group['_id']['type']}" for group in groups}
+        else:
+            changed = {"$gt": datetime.fromisoformat(state["watermark"]), "$lte": until}
+            async for fiche in db.fiches.find({"updated_at": changed}, {"_id": 0, "id": 1, "date_evenement": 1, "type": 1}):
+                affected.add(f"{fiche['date_evenement'].strftime('%Y-%m')}|{fiche['type']}")
+                if fiche["id"] in index:
+                    affected.add(index[fiche["id"]])
+            async for tombstone in db.fiche_tombstones.find({"deleted_at": changed}, {"_id": 0, "id": 1}):
+                if tombstone["id"] in index:
+                    affected.add(index[tombstone["id"]])
+        
+        for partition in affected:
+            month, fiche_type = partition.split("|", 1)
+            start, end = month_bounds(month)
+            cursor = db.fiches.find(
+                {"type": fiche_type, "date_evenement": {"$gte": start, "$lt": end}},
+                {"_id": 0, "photos": 0, "signature": 0}
+            )
+            rows = []
+            async for fiche in cursor:
+                row = export_row(fiche, iso_dates=False)
+                for field in SNAPSHOT_PARTITION_FIELDS:
+                    row.pop(field, None)
+                rows.append(row)
+            await asyncio.to_thread(self._write_partition, month, fiche_type, rows)
+            
+            index = {fiche_id: key for fiche_id, key in index.items() if key != partition}
+            index.update((row["id"], partition) for row in rows)
+        
+        state = {
+            "watermark": until.isoformat(),
+            "partitions": index,
+            "rows": len(index),
+            "partition_count": len(set(index.values())),
+            "refreshed_at": datetime.utcnow().isoformat(),
+            "rebuilt_partitions": len(affected),
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+        await asyncio.to_thread(self._save_state, state)
+        logging.info(f"Analytics snapshot refreshed: {len(affected)} partition(s) rebuilt, {len(index)} fiches")
+        return {key: value for key, value in state.items() if key != "partitions"}
+
+    def status(self) -> Dict[str, Any]:
+        return {key: value for key, value in self.load_state().items() if key != "partitions"}
+
+    def query(self, group_by: List[str], filters: Dict[str, str], month_from: Optional[str],
+              month_to: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        """Fiche counts per group_by values, largest first"""
+        partitioning = pads.partitioning(
+            pa.schema([(field, pa.string()) for field in SNAPSHOT_PARTITION_FIELDS]), flavor="hive"
+        )
+        dataset = pads.dataset(self.path, format="parquet", partitioning=partitioning)
+        if not dataset.files:
+            return []
+        
+        schema = pa.unify_schemas([snapshot_file_schema(), partitioning.schema])
+        for column in group_by:
+            if column not in schema.names or pa.types.is_list(schema.field(column).type):
+                raise HTTPException(status_code=400, detail=f"Colonne de regroupement inconnue: {column}")
+        
+        conditions = [pc.field(field) == value for field, value in filters.items()]
+        if month_from:
+            conditions.append(pc.field("month") >= month_from)
+        if month_to:
+            conditions.append(pc.field("month") <= month_to)
+        expression = functools.reduce(operator.and_, conditions) if conditions else None
+        
+        table = dataset.to_table(columns=list(dict.fromkeys(group_by + ["id"])), filter=expression)
+        result = table.group_by(group_by).aggregate([("id", "count")]).rename_columns(group_by + ["count"])
+        return result.sort_by([("count", "descending")]).slice(0, limit).to_pylist()
+
+analytics_snapshot = AnalyticsSnapshot(ANALYTICS_SNAPSHOT_PATH)
+analytics_snapshot_task: Optional[asyncio.Task] = None
+
+def require_pyarrow():
+    if pa is None:
+        raise HTTPException(status_code=503, detail="Snapshot analytique indisponible (pyarrow non installé)")
+
+async def refresh_snapshot_periodically():
+    while True:
+        try:
+            await analytics_snapshot.refresh()
+        except Exception as e:
+            logging.error(f"Analytics snapshot refresh failed: {e}")
+        await asyncio.sleep(ANALYTICS_SNAPSHOT_INTERVAL)
+
+@api_router.get("/analytics/snapshot")
+async def get_analytics_snapshot_status():
+    require_pyarrow()
+    return await asyncio.to_thread(analytics_snapshot.status)
+
+@api_router.post("/analytics/snapshot")
+async def refresh_analytics_snapshot():
+    require_pyarrow()
+    return await analytics_snapshot.refresh()
+
+@api_router.get("/analytics/snapshot/query")
+async def query_analytics_snapshot(
+    group_by: str,
+    type: Optional[str] = None,
+    statut: Optional[str] = None,
+    service: Optional[str] = None,
+    criticite: Optional[str] = None,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=10000)
+):
+    """Counts from the snapshot, e.g. group_by=ligne,defaut or group_by=month,categorie_corps_etranger;
+    months are YYYY-MM. Reflects the fiches as of the last refresh."""
+    require_pyarrow()
+    filters = {
+        field: value for field, value in
+        (("type", type), ("statut", statut), ("service_emetteur", service), ("criticite", criticite))
+        if value
     }
+    columns = [column.strip() for column in group_by.split(",") if column.strip()]
+    if not columns:
+        raise HTTPException(status_code=400, detail="Paramètre group_by requis")
+    rows = await asyncio.to_thread(analytics_snapshot.query, columns, filters, month_from, month_to, limit)
+    return {"refreshed_at": analytics_snapshot.status().get("refreshed_at"), "rows": rows}
+
+# ----- Indexes -----
+
+@api_router.get("/admin/indexes")
+async def get_index_report():
+    return await index_report()
+
+@api_router.post("/admin/indexes")
+async def rebuild_indexes():
+    await ensure_indexes()
+    return await index_report()
 
 # Include router
 app.include_router(api_router)
@@ -867,6 +3424,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Configure logging
@@ -879,3 +3437,76 @@ logger = logging.getLogger(__name__)
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+
+@app.on_event("startup")
+async def create_indexes():
+    try:
+        await ensure_indexes()
+    except PyMongoError as e:
+        logging.error(f"Index creation skipped, database unreachable: {e}")
+
+stats_reconcile_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_stats_counters():
+    global stats_reconcile_task
+    try:
+        if await db.fiche_stats.count_documents({}, limit=1) == 0:
+            await rebuild_stats()
+    except PyMongoError as e:
+        logging.error(f"Stats counters not built at startup: {e}")
+    if STATS_RECONCILE_INTERVAL > 0:
+        stats_reconcile_task = asyncio.create_task(reconcile_stats_periodically())
+
+@app.on_event("startup")
+async def init_session_secret():
+    try:
+        await get_session_secret()
+    except HTTPException:
+        pass  # Logged; loaded again on the first login or token check
+
+@app.on_event("startup")
+async def start_email_outbox():
+    email_outbox_tasks.extend(asyncio.create_task(email_outbox_worker()) for _ in range(EMAIL_WORKERS))
+    email_outbox_tasks.append(asyncio.create_task(email_digest_scheduler()))
+
+@app.on_event("startup")
+async def start_analytics_snapshot():
+    global analytics_snapshot_task
+    if pa is None:
+        logger.warning("pyarrow non installé: snapshot analytique désactivé")
+    elif ANALYTICS_SNAPSHOT_INTERVAL > 0:
+        analytics_snapshot_task = asyncio.create_task(refresh_snapshot_periodically())
+
+@app.on_event("startup")
+async def preload_excel_template():
+    if not EXCEL_TEMPLATE_PATH.exists():
+        logger.warning(f"Template Excel non trouvé: {EXCEL_TEMPLATE_PATH}")
+        return
+    # Fails startup if a sheet layout does not match the template
+    excel_template_cache.preload()
+    logger.info(f"Excel layouts compiled for template {excel_template_cache.version}")
+
+@app.on_event("shutdown")
+async def shutdown_worker_pools():
+    excel_render_pool.shutdown()
+    photo_pool.shutdown()
+
+@app.on_event("shutdown")
+async def stop_stats_counters():
+    if stats_reconcile_task:
+        stats_reconcile_task.cancel()
+
+@app.on_event("shutdown")
+async def stop_analytics_snapshot():
+    if analytics_snapshot_task:
+        analytics_snapshot_task.cancel()
+
+@app.on_event("shutdown")
+async def stop_email_outbox():
+    # An e-mail interrupted mid-send is taken back by a worker once its lease ends
+    for task in email_outbox_tasks:
+        task.cancel()
+    await asyncio.gather(*email_outbox_tasks, return_exceptions=True)
+    email_outbox_tasks.clear()
+    await smtp_pool.close_all()
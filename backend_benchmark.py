@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+QSE Excel rendering micro-benchmark
+Measures the cost of filling each ENS sheet through the compiled layout
+(anchors resolved once per template version) against resolving merged
+cells on every write, plus the full render (copy + fill + save).
+
+Usage: python backend_benchmark.py [iterations]
+"""
+
+import io
+import sys
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+warnings.simplefilter("ignore")
+
+from server import (  # noqa: E402
+    ActionCorrective, EXCEL_DEFAULT_LAYOUT, FicheQSE, excel_template_cache, fill_workbook
+)
+
+SAMPLE_FICHE = {
+    "date_evenement": datetime(2026, 2, 17),
+    "heure_evenement": "14:30",
+    "constate_par": "Pierre Martin",
+    "service_emetteur": "Fabrication PPC",
+    "service_concerne": "Affinage PPC",
+    "non_conformite_constatee": "Produit Fini",
+    "defaut": "Corps étranger",
+    "categorie_corps_etranger": "Plastique dur",
+    "produit": "Meule 40kg",
+    "numero_lot": "L2026-048",
+    "ligne": "Ligne 3",
+    "description": "Morceau de plastique retrouvé en sortie saumure",
+    "criticite": "Majeure",
+    "traitement_blocage": True,
+    "traitement_analyses": True,
+    "type_incident": "Situation dangereuse",
+    "regle_or": "Machines",
+    "type_env": "Eaux (fuite : eaux usées, eaux pluviales, eaux de ville...)",
+    "cause_main_oeuvre": "Formation",
+    "cause_materiel": "Racleur usé",
+    "cause_methode": "Contrôle visuel",
+    "cause_milieu": "Humidité",
+    "cause_matiere": "Film",
+    "actions_correctives": [
+        ActionCorrective(action="Remplacer le racleur", responsable="Maintenance", delai="J+2"),
+        ActionCorrective(action="Sensibiliser l'équipe", responsable="Chef d'équipe", delai="J+7"),
+    ],
+    "created_by": "benchmark",
+}
+
+
+def write_cell_with_scan(ws, cell_coord, value):
+    """Write to a cell, resolving merged ranges by scanning them on every call"""
+    if value is None:
+        return
+    for merged_range in ws.merged_cells.ranges:
+        if cell_coord in merged_range:
+            ws[str(merged_range).split(':')[0]] = value
+            return
+    ws[cell_coord] = value
+
+
+def fill_with_scan(wb, fiche, layouts):
+    """Same writes as the compiled layout, resolving merged cells by scanning"""
+    layout = layouts.get(fiche.type) or layouts[EXCEL_DEFAULT_LAYOUT]
+    ws = wb[layout.sheet]
+    for cell, _, get_value in layout.operations:
+        write_cell_with_scan(ws, cell, get_value(fiche))
+
+
+def time_fill(fiche, compiled, iterations):
+    """Average fill time on fresh template copies"""
+    total = 0.0
+    for _ in range(iterations):
+        wb, layouts = excel_template_cache.get_workbook()
+        start = time.perf_counter()
+        if compiled:
+            fill_workbook(wb, fiche, layouts)
+        else:
+            fill_with_scan(wb, fiche, layouts)
+        total += time.perf_counter() - start
+    return total / iterations
+
+
+def time_render(fiche, iterations):
+    """Average time of a full in-memory render"""
+    total = 0.0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        wb, layouts = excel_template_cache.get_workbook()
+        fill_workbook(wb, fiche, layouts)
+        wb.save(io.BytesIO())
+        total += time.perf_counter() - start
+    return total / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    excel_template_cache.get_workbook()  # Warm the template cache
+
+    print(f"Excel rendering benchmark ({iterations} iterations per measure)")
+    print(f"{'Sheet':<16}{'fill scan (ms)':>16}{'fill compiled (ms)':>20}{'speedup':>10}{'render (ms)':>13}")
+    for fiche_type in ("Qualité", "Sécurité", "Environnement"):
+        fiche = FicheQSE(type=fiche_type, **SAMPLE_FICHE)
+        scan = time_fill(fiche, False, iterations)
+        compiled = time_fill(fiche, True, iterations)
+        render = time_render(fiche, iterations)
+        print(f"{fiche_type:<16}{scan * 1000:>16.3f}{compiled * 1000:>20.3f}{scan / compiled:>9.1f}x{render * 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
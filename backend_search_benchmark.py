@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+QSE full-text search benchmark
+Seeds a scratch database with generated fiches (fixed random seed), builds the
+fiche indexes including the French text index, and times the query run by
+GET /api/fiches/search (text score, keyset sort on score then newest): the
+first page of 20 and, for queries with enough matches, the page after
+DEEP_PAGE pages reached through the cursor.
+
+Requires a running MongoDB (MONGO_URL, default mongodb://localhost:27017).
+The fiches go to SEARCH_BENCHMARK_DB (default qse_search_benchmark), which is
+reused on later runs while it holds the requested number of fiches.
+Usage: python backend_search_benchmark.py [fiches] [runs per query]
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import warnings
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+warnings.simplefilter("ignore")
+
+# Never seed the application database
+os.environ["DB_NAME"] = os.environ.get("SEARCH_BENCHMARK_DB", "qse_search_benchmark")
+
+from server import (  # noqa: E402
+    DEFAULT_CONFIG, FicheQSE, build_fiche_query, db, encode_search_cursor, ensure_indexes,
+    fiche_search_cursor
+)
+
+SEED = 20260217
+PAGE_SIZE = 20
+DEEP_PAGE = 50
+TARGET_MS = 100
+INSERT_BATCH = 5000
+
+INCIDENTS = [
+    "fuite saumure", "fuite d'eau glycolée", "morceau de plastique", "corps étranger métallique",
+    "moisissures en surface", "croûte fendue", "étiquette illisible", "film mal soudé",
+    "palette renversée", "chute de meule", "sol glissant", "odeur anormale", "bac de lait percé",
+    "température cuve trop haute", "capteur défaillant", "racleur usé", "joint de porte abîmé",
+]
+PLACES = ["sortie saumure", "démouleuse", "cave d'affinage", "quai d'expédition", "salle de levains", "laverie"]
+CAUSES = [
+    "formation insuffisante", "usure du matériel", "procédure non respectée", "humidité élevée",
+    "fournisseur non conforme", "maintenance reportée", "contrôle visuel absent", "nettoyage incomplet",
+]
+ACTIONS = [
+    "remplacer la pièce", "sensibiliser l'équipe", "renforcer le contrôle", "mettre à jour la procédure",
+    "bloquer le lot", "nettoyer la zone", "prévenir la maintenance",
+]
+PRODUCTS = ["Meule 40kg", "Portion 200g", "Râpé 1kg", "Bloc 2kg", "Tranches 150g"]
+
+# (label, search text, filters as in the endpoint's query string)
+QUERIES = [
+    ("two words", "fuite saumure", {}),
+    ("five words", "corps étranger plastique ligne 3", {}),
+    ("phrase", '"sortie saumure"', {}),
+    ("lot number", "L2025-0420", {}),
+    ("rare word", "glycolée", {}),
+    ("word + filters", "moisissures", {"type": "Qualité", "statut": "Validé"}),
+    ("excluded word", "fuite -saumure", {}),
+]
+
+
+def generate_fiche(rng: random.Random, index: int, start: datetime) -> dict:
+    created_at = start + timedelta(minutes=index * 10 + rng.randint(0, 9))
+    fiche_type = rng.choice(["Qualité", "Sécurité", "Environnement"])
+    place = rng.choice(PLACES)
+    return FicheQSE(
+        type=fiche_type,
+        date_evenement=created_at.replace(hour=0, minute=0),
+        heure_evenement=created_at.strftime("%H:%M"),
+        constate_par="Benchmark",
+        service_emetteur=rng.choice(DEFAULT_CONFIG["services"]),
+        description=f"{rng.choice(INCIDENTS).capitalize()} constaté(e) en {place}, {rng.choice(INCIDENTS)}",
+        criticite=rng.choice(["Mineure", "Majeure", "Critique"]),
+        statut=rng.choice(["Brouillon", "Validé", "Envoyé"]),
+        defaut=rng.choice(DEFAULT_CONFIG["defauts"]) if fiche_type == "Qualité" else None,
+        categorie_corps_etranger=rng.choice(DEFAULT_CONFIG["categories_corps_etranger"]) if fiche_type == "Qualité" else None,
+        produit=rng.choice(PRODUCTS),
+        ligne=f"Ligne {rng.randint(1, 6)}",
+        numero_lot=f"L{created_at.year}-{rng.randint(1, 999):04d}",
+        cause_main_oeuvre=rng.choice(CAUSES),
+        cause_materiel=rng.choice(CAUSES),
+        cause_methode=rng.choice(CAUSES),
+        actions_correctives=[{"action": rng.choice(ACTIONS), "responsable": "Chef d'équipe"}],
+        created_by="benchmark",
+        created_at=created_at,
+        updated_at=created_at,
+    ).model_dump()
+
+
+async def seed(count: int):
+    if await db.fiches.estimated_document_count() == count:
+        print(f"Reusing {count} fiches in {db.name}")
+        return
+    await db.fiches.delete_many({})
+    rng = random.Random(SEED)
+    start = datetime(2024, 1, 1)
+    begin = time.perf_counter()
+    for offset in range(0, count, INSERT_BATCH):
+        batch = [generate_fiche(rng, index, start) for index in range(offset, min(offset + INSERT_BATCH, count))]
+        await db.fiches.insert_many(batch, ordered=False)
+    print(f"Seeded {count} fiches in {db.name} in {time.perf_counter() - begin:.1f} s")
+
+
+async def fetch_page(q: str, query: dict, cursor=None):
+    return await fiche_search_cursor(q, query, PAGE_SIZE + 1, cursor).to_list(PAGE_SIZE + 1)
+
+
+async def deep_cursor(q: str, query: dict):
+    """Cursor of page DEEP_PAGE, or None when the query has fewer matches"""
+    cursor = None
+    for _ in range(DEEP_PAGE):
+        page = await fetch_page(q, query, cursor)
+        if len(page) <= PAGE_SIZE:
+            return None
+        cursor = encode_search_cursor(page[PAGE_SIZE - 1])
+    return cursor
+
+
+async def time_page(q: str, query: dict, cursor, runs: int):
+    await fetch_page(q, query, cursor)  # Warm the cache
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fetch_page(q, query, cursor)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return statistics.median(timings), p95
+
+
+async def time_query(q: str, filters: dict, runs: int):
+    query = build_fiche_query(**filters)
+    matches = await db.fiches.count_documents({"$text": {"$search": q}, **query})
+    first = await time_page(q, query, None, runs)
+    cursor = await deep_cursor(q, query)
+    deep = await time_page(q, query, cursor, runs) if cursor else None
+    return matches, first, deep
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    await seed(count)
+    await ensure_indexes()
+
+    print(f"Search benchmark ({count} fiches, pages of {PAGE_SIZE}, {runs} runs per query)")
+    print(f"{'Query':<18}{'matches':>10}{'median (ms)':>14}{'p95 (ms)':>12}{f'page {DEEP_PAGE + 1} p95':>16}")
+    worst = 0.0
+    for label, q, filters in QUERIES:
+        matches, (median, p95), deep = await time_query(q, filters, runs)
+        worst = max(worst, p95, deep[1] if deep else 0.0)
+        deep_p95 = f"{deep[1]:.1f}" if deep else "-"
+        print(f"{label:<18}{matches:>10}{median:>14.1f}{p95:>12.1f}{deep_p95:>16}")
+    print(f"Worst p95: {worst:.1f} ms ({'within' if worst < TARGET_MS else 'over'} the {TARGET_MS} ms target)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
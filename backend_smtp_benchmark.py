@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+QSE SMTP throughput benchmark
+Sends the same fiche-sized e-mail to a local aiosmtpd server, opening a
+session per message (aiosmtplib.send) and through the pooled sessions
+used by the e-mail outbox, sequentially and with concurrent workers.
+
+Uses aiosmtpd, pinned in backend/requirements.txt (pip install -r backend/requirements.txt).
+Usage: python backend_smtp_benchmark.py [messages] [attachment KB]
+"""
+
+import asyncio
+import logging
+import sys
+import time
+import warnings
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+warnings.simplefilter("ignore")
+
+import aiosmtplib  # noqa: E402
+from aiosmtpd.controller import Controller  # noqa: E402
+from aiosmtpd.smtp import AuthResult  # noqa: E402
+
+from server import EMAIL_WORKERS, EmailConfig, SmtpConnectionPool  # noqa: E402
+
+SMTP_PORT = 8025
+ATTACHMENT_KB = 200  # Roughly an Excel report plus a resized photo
+
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+
+def build_message(config, attachment_kb):
+    msg = MIMEMultipart()
+    msg["Subject"] = "Déclaration non-conformité – benchmark"
+    msg["From"] = config.smtp_user
+    msg["To"] = ", ".join(config.default_recipients)
+    msg.attach(MIMEText("Fiche de non-conformité (benchmark)", "plain"))
+    msg.attach(MIMEApplication(b"\0" * attachment_kb * 1024, Name="fiche.xlsm"))
+    return msg
+
+
+async def send_unpooled(config, msg, count):
+    for _ in range(count):
+        await aiosmtplib.send(
+            msg,
+            hostname=config.smtp_server,
+            port=config.smtp_port,
+            username=config.smtp_user,
+            password=config.smtp_password,
+            use_tls=config.use_tls
+        )
+
+
+async def send_pooled(config, msg, count, workers):
+    pool = SmtpConnectionPool(workers, idle_timeout=60, check_after=10)
+    remaining = iter(range(count))
+
+    async def worker():
+        for _ in remaining:
+            async with pool.connection(config) as smtp:
+                await smtp.send_message(msg)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    await pool.close_all()
+    return pool.stats()
+
+
+async def measure(label, count, coroutine):
+    start = time.perf_counter()
+    result = await coroutine
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28}{elapsed * 1000 / count:>12.2f}{count / elapsed:>14.1f}")
+    return result
+
+
+async def main():
+    logging.getLogger("mail.log").setLevel(logging.ERROR)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    attachment_kb = int(sys.argv[2]) if len(sys.argv) > 2 else ATTACHMENT_KB
+    handler = CountingHandler()
+    controller = Controller(
+        handler, hostname="127.0.0.1", port=SMTP_PORT,
+        authenticator=lambda *args: AuthResult(success=True), auth_require_tls=False
+    )
+    controller.start()
+    try:
+        config = EmailConfig(
+            smtp_server="127.0.0.1", smtp_port=SMTP_PORT, smtp_user="qse@example.com",
+            smtp_password="benchmark", use_tls=False, default_recipients=["qualite@example.com"]
+        )
+        msg = build_message(config, attachment_kb)
+
+        print(f"SMTP benchmark ({count} messages with a {attachment_kb} KB attachment, aiosmtpd on 127.0.0.1)")
+        print(f"{'Mode':<28}{'ms/message':>12}{'messages/s':>14}")
+        await measure("session per message", count, send_unpooled(config, msg, count))
+        stats = await measure("pooled, 1 worker", count, send_pooled(config, msg, count, 1))
+        print(f"  sessions opened: {stats['opened']}, reused: {stats['reused']}")
+        stats = await measure(f"pooled, {EMAIL_WORKERS} workers", count, send_pooled(config, msg, count, EMAIL_WORKERS))
+        print(f"  sessions opened: {stats['opened']}, reused: {stats['reused']}")
+        print(f"Messages received: {handler.received}")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -26,7 +26,7 @@ export default function History() {
 
   const loadFiches = async () => {
     try {
-      const params: any = {};
+      const params: any = { view: 'summary' };
       if (filterType) params.type = filterType;
       if (filterStatus) params.statut = filterStatus;
       const data = await ficheApi.getAll(params);
@@ -264,7 +264,7 @@ export default function FicheDetail() {
             {fiche.photos.map((photo, index) => (
               <Image
                 key={photo.id || index}
-                source={{ uri: `data:image/jpeg;base64,${photo.data}` }}
+                source={{ uri: photo.data ? `data:image/jpeg;base64,${photo.data}` : ficheApi.photoUrl(photo.id, 'thumbnail') }}
                 style={styles.photoImage}
               />
             ))}
@@ -74,7 +74,9 @@ export default function Login() {
 
     setIsLoading(true);
     try {
-      const user = await userApi.create(newUser);
+      await userApi.create(newUser);
+      // Signing in returns the session token restored at next launch
+      const user = await userApi.login(newUser.code);
       setUser(user);
       router.replace('/(tabs)/home');
     } catch (error) {
@@ -1,6 +1,7 @@
 import { create } from 'zustand';
 import AsyncStorage from '@react-native-async-storage/async-storage';
 import { User } from '../types';
+import { userApi } from '../utils/api';
 
 interface AuthState {
   user: User | null;
@@ -24,10 +25,30 @@ export const useAuthStore = create<AuthState>((set) => ({
   loadUser: async () => {
     try {
       const userStr = await AsyncStorage.getItem('user');
-      if (userStr) {
-        set({ user: JSON.parse(userStr), isLoading: false });
-      } else {
-        set({ isLoading: false });
+      const stored: User | null = userStr ? JSON.parse(userStr) : null;
+      if (!stored?.session_token) {
+        // No session token (saved by an older version): sign in again
+        await AsyncStorage.removeItem('user');
+        set({ user: null, isLoading: false });
+        return;
+      }
+
+      // The API client sends the token of the current user
+      set({ user: stored });
+      try {
+        const me = await userApi.me();
+        const user = { ...me, session_token: stored.session_token };
+        await AsyncStorage.setItem('user', JSON.stringify(user));
+        set({ user, isLoading: false });
+      } catch (error: any) {
+        if (error.response?.status === 401) {
+          // Expired or invalid session
+          await AsyncStorage.removeItem('user');
+          set({ user: null, isLoading: false });
+        } else {
+          // Offline: keep the stored identity until the server can check the token
+          set({ isLoading: false });
+        }
       }
     } catch (e) {
       set({ isLoading: false });
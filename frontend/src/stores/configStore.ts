@@ -75,11 +75,18 @@ export const useConfigStore = create<ConfigState>((set) => ({
   
   loadConfig: async () => {
     try {
-      // First try to load from API
-      const response = await axios.get(`${getCurrentBackendUrl()}/api/config`);
-      if (response.data && response.data.services) {
+      // First try to load from API; a 304 means the stored copy is still current
+      const etag = await AsyncStorage.getItem('configEtag');
+      const response = await axios.get(`${getCurrentBackendUrl()}/api/config`, {
+        headers: etag ? { 'If-None-Match': etag } : undefined,
+        validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+      });
+      if (response.status !== 304 && response.data && response.data.services) {
         set({ config: response.data, isLoading: false });
         await AsyncStorage.setItem('config', JSON.stringify(response.data));
+        if (response.headers.etag) {
+          await AsyncStorage.setItem('configEtag', response.headers.etag);
+        }
         return;
       }
     } catch (e) {
@@ -105,6 +112,7 @@ export const useConfigStore = create<ConfigState>((set) => ({
     try {
       await axios.put(`${getCurrentBackendUrl()}/api/config`, config);
       await AsyncStorage.setItem('config', JSON.stringify(config));
+      await AsyncStorage.removeItem('configEtag');
       set({ config });
     } catch (e) {
       console.error('Error updating config:', e);
@@ -3,10 +3,10 @@ import AsyncStorage from '@react-native-async-storage/async-storage';
 import { FicheQSE, Photo, ActionCorrective } from '../types';
 import { format } from 'date-fns';
 import { v4 as uuidv4 } from 'uuid';
-import { ficheApi } from '../utils/api';
+import { ficheApi, syncApi } from '../utils/api';
 
 export interface OfflineFiche {
-  local_id: string;
+  local_id: string; // Sent as the client_id of the fiche: replays never create it twice
   payload: Partial<FicheQSE>;
   queued_at: string;
   attempts: number;
@@ -31,6 +31,8 @@ interface FicheState {
 }
 
 const OFFLINE_STORAGE_KEY = 'offlineFiches';
+// Fiches per POST /sync request; photos travel inline, so requests are kept small
+const SYNC_BATCH_SIZE = 10;
 
 const initialFiche: Partial<FicheQSE> = {
   type: 'Qualité',
@@ -129,19 +131,38 @@ export const useFicheStore = create<FicheState>((set, get) => ({
 
     const survivors: OfflineFiche[] = [];
     let synced = 0;
+    const keep = (item: OfflineFiche, error: string) => {
+      survivors.push({ ...item, attempts: item.attempts + 1, last_error: error });
+    };
 
-    for (const item of pending) {
+    for (let start = 0; start < pending.length; start += SYNC_BATCH_SIZE) {
+      const batch = pending.slice(start, start + SYNC_BATCH_SIZE);
+      let results: { client_id: string; id?: string; status: string; error?: string }[];
       try {
-        const createdFiche = await ficheApi.create(item.payload);
-        await ficheApi.validate(createdFiche.id);
-        await ficheApi.sendEmail(createdFiche.id);
-        synced += 1;
+        const response = await syncApi.syncFiches(
+          batch.map((item) => ({ ...item.payload, client_id: item.local_id }))
+        );
+        results = response.results;
       } catch (error: any) {
-        survivors.push({
-          ...item,
-          attempts: item.attempts + 1,
-          last_error: error?.message || 'Erreur réseau ou backend',
-        });
+        batch.forEach((item) => keep(item, error?.message || 'Erreur réseau ou backend'));
+        continue;
+      }
+
+      for (let index = 0; index < batch.length; index++) {
+        const item = batch[index];
+        const result = results[index];
+        if (!result?.id || result.status === 'failed') {
+          keep(item, result?.error || 'Erreur de synchronisation');
+          continue;
+        }
+        // Also for already_synced: a previous attempt may have stopped before validating
+        try {
+          await ficheApi.validate(result.id);
+          await ficheApi.sendEmail(result.id);
+          synced += 1;
+        } catch (error: any) {
+          keep(item, error?.message || 'Erreur réseau ou backend');
+        }
       }
     }
 
@@ -5,12 +5,15 @@ export interface User {
   first_name: string;
   service: string;
   is_admin: boolean;
+  session_token?: string;
 }
 
 export interface Photo {
   id: string;
-  data: string;
+  data?: string; // Base64, only until the photo is stored on the server
   filename: string;
+  content_type?: string;
+  size?: number;
   created_at: string;
 }
 
@@ -2,6 +2,7 @@ import axios from 'axios';
 import { FicheQSE } from '../types';
 
 import { getBackendUrl } from './backendUrl';
+import { useAuthStore } from '../stores/authStore';
 
 const API_URL = getBackendUrl();
 
@@ -14,6 +15,10 @@ const api = axios.create({
 
 api.interceptors.request.use((config) => {
   config.baseURL = `${getCurrentBackendUrl()}/api`;
+  const token = useAuthStore.getState().user?.session_token;
+  if (token) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
   return config;
 });
 
@@ -22,6 +27,10 @@ export const userApi = {
     const response = await api.post('/users/login', { code });
     return response.data;
   },
+  me: async () => {
+    const response = await api.get('/users/me');
+    return response.data;
+  },
   create: async (user: any) => {
     const response = await api.post('/users', user);
     return response.data;
@@ -41,6 +50,10 @@ export const ficheApi = {
     const response = await api.get('/fiches', { params });
     return response.data;
   },
+  search: async (q: string, params?: { limit?: number; cursor?: string; view?: 'full' | 'summary'; [filter: string]: any }) => {
+    const response = await api.get('/fiches/search', { params: { ...params, q } });
+    return response.data;
+  },
   getOne: async (id: string) => {
     const response = await api.get(`/fiches/${id}`);
     return response.data;
@@ -62,6 +75,8 @@ export const ficheApi = {
     return response.data;
   },
   download: (id: string) => `${getCurrentBackendUrl()}/api/fiches/${id}/download`,
+  photoUrl: (photoId: string, variant?: 'thumbnail' | 'attachment') =>
+    `${getCurrentBackendUrl()}/api/photos/${photoId}${variant ? `?variant=${variant}` : ''}`,
 };
 
 export const statsApi = {
@@ -72,10 +87,15 @@ export const statsApi = {
 };
 
 export const syncApi = {
-  syncFiches: async (fiches: FicheQSE[]) => {
+  // Each fiche carries the client_id generated on the device, so a retried sync stores it once
+  syncFiches: async (fiches: (Partial<FicheQSE> & { client_id: string })[]) => {
     const response = await api.post('/sync', fiches);
     return response.data;
   },
+  changes: async (since?: string, params?: { limit?: number; view?: 'full' | 'summary' }) => {
+    const response = await api.get('/sync/changes', { params: { ...params, since } });
+    return response.data;
+  },
 };
 
 export default api;